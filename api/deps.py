@@ -1,16 +1,113 @@
+import hashlib
+import json
+import threading
+import time
 import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from config import SECRET_KEY, ALGORITHM
+from config import SECRET_KEY, ALGORITHM, REDIS_URL
 
 bearer_scheme = HTTPBearer()
 
+# 用户信息缓存：user_id -> {username, email, role}
+# 用户数据变更的接口（绑定/解绑/改密码等）需调用 pop_user_info 使其失效
+# User info cache; mutation endpoints must call pop_user_info to invalidate
+user_info_cache = TTLCache(maxsize=5000, ttl=60)
+
+# 多 worker 部署时进程内缓存命中率只有 1/N，配置 REDIS_URL 后用 Redis 作共享二级缓存
+# With multiple workers the in-process cache only hits 1/N of the time;
+# REDIS_URL enables a shared second tier
+_redis = None
+if REDIS_URL:
+    import redis.asyncio as redis
+    _redis = redis.from_url(REDIS_URL, decode_responses=True)
+
+_USER_KEY = "ess:user:{uid}"
+_USER_TTL = 60
+
+async def get_user_info(uid):
+    """先查进程内缓存，再查 Redis（如启用）；未命中返回 None"""
+    data = user_info_cache.get(uid)
+    if data is not None:
+        return data
+    if _redis is not None:
+        raw = await _redis.get(_USER_KEY.format(uid=uid))
+        if raw:
+            data = json.loads(raw)
+            user_info_cache[uid] = data
+            return data
+    return None
+
+async def set_user_info(uid, data):
+    user_info_cache[uid] = data
+    if _redis is not None:
+        await _redis.set(_USER_KEY.format(uid=uid), json.dumps(data), ex=_USER_TTL)
+
+async def pop_user_info(uid):
+    user_info_cache.pop(uid, None)
+    if _redis is not None:
+        await _redis.delete(_USER_KEY.format(uid=uid))
+
+# JWT 校验结果缓存：HS256 验签是纯 CPU 开销，同一 Token 短时间内重复请求很常见
+# ttl 远小于 Token 有效期，只缓存成功结果，失败（过期/伪造）每次都重新校验
+# Cache successful jwt.decode results keyed by token hash; TTL is short so a
+# token nearing its exp is re-verified promptly. Failures are never cached.
+_jwt_cache = TTLCache(maxsize=10000, ttl=10)
+
+# get_current_user 是同步依赖，FastAPI 会放进线程池执行；TTLCache 不是线程安全的
+# （过期整理可能在并发读写下损坏），所有缓存操作都在锁内完成
+# get_current_user is a sync dependency, so FastAPI runs it on threadpool
+# threads; TTLCache is not thread-safe (expiry bookkeeping can corrupt under
+# concurrent mutation), so every cache operation happens under this lock
+_jwt_lock = threading.Lock()
+
+# 复用单个 PyJWT 实例并强制要求 exp 声明，省掉模块级 decode 的转发开销
+# One reused PyJWT instance; exp is required so unbounded tokens are rejected
+_jwt = jwt.PyJWT()
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     token = credentials.credentials
+    key = hashlib.sha256(token.encode()).digest()
+    with _jwt_lock:
+        payload = _jwt_cache.get(key)
+    if payload is not None:
+        # 命中也复核 exp，避免在 TTL 窗口内放行刚过期的 Token
+        # Re-check exp on hits so a token expiring inside the TTL window
+        # is rejected immediately instead of riding out the cache entry
+        if payload["exp"] <= time.time():
+            with _jwt_lock:
+                _jwt_cache.pop(key, None)
+            raise HTTPException(status_code=401, detail="Token已过期")
+        return payload
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp"]})
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token已过期")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="无效的Token")
+    with _jwt_lock:
+        _jwt_cache[key] = payload
     return payload
+
+# 角色常量用 frozenset，成员判断 O(1)；通用的角色校验做成依赖，
+# 处理函数直接 Depends 即可，不再各自复制 if/raise
+# Role sets as frozensets for O(1) membership; the recurring role checks
+# are FastAPI dependencies so handlers no longer repeat the if/raise pair
+_ADMIN_ROLES = frozenset({"admin", "service"})
+_STAFF_ROLES = frozenset({"admin", "service", "support"})
+
+def require_admin(user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="仅管理员可用")
+    return user
+
+def require_admin_or_service(user=Depends(get_current_user)):
+    if user["role"] not in _ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail="无权限")
+    return user
+
+def require_staff(user=Depends(get_current_user)):
+    if user["role"] not in _STAFF_ROLES:
+        raise HTTPException(status_code=403, detail="无权限")
+    return user
@@ -1,24 +1,54 @@
 from datetime import datetime, timedelta, date, time as dtime, timezone
-from fastapi import FastAPI, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+import orjson
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from sqlalchemy import text, func
+from cachetools import TTLCache
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import asyncio
 import json
 import decimal
 
-from deps import get_current_user
+import mqtt_client
+from deps import require_admin_or_service, require_staff
 from config import DATABASE_URL, DEVICE_FRESH_SECS, ALARM_HISTORY_RETENTION_DAYS, RPC_LOG_RETENTION_DAYS
 
-app = FastAPI(title="ESS Realtime API", version="1.0.0")
-
-engine = create_async_engine(DATABASE_URL, pool_pre_ping=True)
+# orjson 序列化比标准库 json 快数倍，尤其是大列表响应
+app = FastAPI(title="ESS Realtime API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# 连接池按并发量调大（默认 5+10 在高并发下会排队）；后端连接复用交给 pgbouncer
+# transaction 模式，因此 asyncpg 必须关闭 prepared-statement 缓存，JIT 对短查询只有开销
+# Pool sized for concurrency; pgbouncer (transaction mode) multiplexes the
+# backend connections, which requires statement_cache_size=0 for asyncpg
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=20,
+    max_overflow=20,
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+    connect_args={
+        "server_settings": {"jit": "off"},
+        "statement_cache_size": 0,
+    },
+)
 
 # 放到前面，供 routers 导入
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+# 只读接口通过依赖注入拿连接，FastAPI 在响应结束后自动归还连接池；
+# 需要事务或并行查询的接口仍自行管理连接
+# Read-only endpoints take a pooled connection via dependency injection;
+# FastAPI returns it to the pool after the response. Handlers that need a
+# transaction or parallel queries keep managing their own connections.
+async def get_conn():
+    async with engine.connect() as conn:
+        yield conn
+
 # ---------------- 公共模型与常量 ----------------
 
 COLUMNS = """
@@ -29,10 +59,175 @@ r.p_a, r.p_b, r.p_c, r.q_a, r.q_b, r.q_c,
 r.e_pv_today, r.e_load_today, r.e_charge_today, r.e_discharge_today
 """
 
-def online_flag(updated_at: datetime, fresh_secs: int) -> bool:
+# SQL 语句在模块加载时构建一次，请求内只做参数绑定
+# Statements are built once at import; handlers only bind parameters
+# ess_realtime_data 以 device_id 为主键（每设备一行），device_sn 唯一，
+# 因此该查询天然最多返回一行，无需 ORDER BY/LIMIT
+# ess_realtime_data is keyed by device_id (one row per device) and
+# device_sn is unique, so this query returns at most one row by design
+REALTIME_BY_SN_SQL = text(f"""
+    SELECT {COLUMNS},
+           (now() - r.updated_at) <= make_interval(secs => :fresh) AS online
+    FROM ess_realtime_data r
+    JOIN devices d ON r.device_id = d.id
+    WHERE d.device_sn=:sn
+""")
+
+DEVICE_BY_SN_SQL = text("SELECT id, device_sn FROM devices WHERE device_sn=:sn")
+DEVICE_ID_BY_SN_SQL = text("SELECT id FROM devices WHERE device_sn=:sn")
+
+# device_sn -> id 映射实际不可变（换绑只改 user_id），TTL 仅作兜底；
+# 未命中（设备不存在）不缓存，避免新设备注册后被挡
+# The sn->id mapping is effectively immutable (rebinding only changes
+# user_id); misses are never cached so newly provisioned devices resolve
+_device_id_cache = TTLCache(maxsize=10000, ttl=300)
+
+async def resolve_device_id(device_sn: str) -> Optional[int]:
+    """device_sn 解析为设备 id，带进程内 TTL 缓存；不存在返回 None"""
+    device_id = _device_id_cache.get(device_sn)
+    if device_id is not None:
+        return device_id
+    async with engine.connect() as conn:
+        device_id = (await conn.execute(DEVICE_ID_BY_SN_SQL, {"sn": device_sn})).scalar_one_or_none()
+    if device_id is None:
+        return None
+    _device_id_cache[device_sn] = device_id
+    return device_id
+
+def _admin_history_sql(group_expr: str, group_label: str):
+    # COUNT(*) OVER() 在分组结果上带回总数，一条语句替代 count + page 两次往返
+    # Window count over the grouped rows returns the total alongside the page,
+    # one statement instead of the count + page pair
+    cond = "WHERE device_id = :id0 AND ts >= :start AND ts <= :end"
+    other = [l for l in ("hour", "day", "month") if l != group_label]
+    return text(f"""
+        SELECT
+            device_id,
+            {group_expr} AS {group_label},
+            NULL AS {other[0]},
+            NULL AS {other[1]},
+            SUM(charge_wh_total) AS charge_wh_total,
+            SUM(discharge_wh_total) AS discharge_wh_total,
+            SUM(pv_wh_total) AS pv_wh_total,
+            SUM(grid_wh_total) AS grid_wh_total,
+            SUM(load_wh_total) AS load_wh_total,
+            COUNT(*) OVER() AS __total
+        FROM history_energy
+        {cond}
+        GROUP BY device_id, {group_label}
+        ORDER BY {group_label} DESC
+        LIMIT :limit OFFSET :offset
+    """)
+
+# 聚合粒度只有三种，预先生成全部变体
+_ADMIN_HISTORY_SQL = {
+    label: _admin_history_sql(expr, label)
+    for label, expr in (
+        ("hour", "date_trunc('hour', ts)"),
+        ("day", "date_trunc('day', ts)"),
+        ("month", "date_trunc('month', ts)"),
+    )
+}
+
+DEVICE_COUNT_SQL = text("SELECT COUNT(*) FROM devices")
+
+ONLINE_COUNT_SQL = text("""
+    WITH latest AS (
+      SELECT device_id, MAX(updated_at) AS updated_at
+      FROM ess_realtime_data
+
+      GROUP BY device_id
+    )
+    SELECT COUNT(*)
+    FROM devices d
+    LEFT JOIN latest r ON r.device_id = d.id
+    WHERE r.updated_at IS NOT NULL
+      AND r.updated_at >= now() - make_interval(secs => :fresh)
+""")
+
+# 清理按小批量执行，每批一个事务：锁和 WAL 压力被分摊，长事务不再阻塞业务写入
+# Cleanup runs in small batches, one transaction each, so locks release and
+# WAL stays bounded instead of one long DELETE holding everything
+_CLEANUP_BATCH = 500
+CLEANUP_ALARM_HISTORY_SQL = text("""
+    DELETE FROM alarm_history
+    WHERE ctid IN (
+        SELECT ctid FROM alarm_history
+        WHERE archived_at < :cutoff
+        LIMIT :batch
+    )
+""")
+CLEANUP_RPC_LOG_SQL = text("""
+    DELETE FROM device_rpc_change_log
+    WHERE ctid IN (
+        SELECT ctid FROM device_rpc_change_log
+        WHERE created_at < :cutoff
+        LIMIT :batch
+    )
+""")
+
+# db_metrics 的各项指标语句，全部无业务参数，构建一次即可
+# Metric statements for db_metrics; none take business parameters
+# pg_stat_activity 是函数视图，每扫一次都重读后端状态；
+# 四个计数用 FILTER 聚合一趟扫完，慢查询列表从活跃列表里派生
+# pg_stat_activity rescans backend state per query, so the four counters
+# share one FILTER-aggregated scan; the slow list is derived from the
+# active list (same ordering, same cap)
+_PG_ACTIVITY_SUMMARY_SQL = text("""
+    SELECT
+        count(*) AS conn_count,
+        count(*) FILTER (WHERE state = 'active') AS tx_count,
+        count(*) FILTER (WHERE state = 'idle') AS idle_conn,
+        count(*) FILTER (WHERE wait_event IS NOT NULL) AS waiting_count
+    FROM pg_stat_activity
+""")
+_PG_ACTIVE_SQL = text("""
+    -- query 文本可达数 KB，截断到 500 字符足够定位语句
+    -- Query text can run to kilobytes; 500 chars is enough to identify it
+    SELECT pid, usename, application_name, client_addr, state,
+           substring(query, 1, 500) AS query,
+           now() - query_start AS duration
+    FROM pg_stat_activity
+    WHERE state != 'idle'
+    ORDER BY duration DESC
+    LIMIT 20
+""")
+_PG_DB_SIZE_SQL = text("SELECT pg_size_pretty(pg_database_size(current_database()))")
+_PG_TABLE_SIZES_SQL = text("""
+    SELECT relname AS table, pg_size_pretty(pg_total_relation_size(relid)) AS size
+    FROM pg_catalog.pg_statio_user_tables
+    ORDER BY pg_total_relation_size(relid) DESC
+    LIMIT 10
+""")
+_PG_HIT_RATE_SQL = text("""
+    SELECT
+        ROUND(SUM(blks_hit) / NULLIF(SUM(blks_hit) + SUM(blks_read),0)::numeric, 4) AS hit_rate
+    FROM pg_stat_database
+""")
+_PG_DEADLOCKS_SQL = text("SELECT SUM(deadlocks) FROM pg_stat_database")
+_PG_START_TIME_SQL = text("SELECT pg_postmaster_start_time()")
+_PG_VERSION_SQL = text("SHOW server_version")
+_PG_MAX_CONN_SQL = text("SHOW max_connections")
+_PG_STAT_STATEMENTS_SQL = text("""
+    SELECT
+        substring(query, 1, 500) AS query,
+        calls,
+        total_exec_time,
+        mean_exec_time,
+        max_exec_time
+    FROM pg_stat_statements
+    WHERE calls > 10
+    ORDER BY mean_exec_time DESC
+    LIMIT 10
+""")
+
+def online_flag(updated_at: datetime, fresh_secs: int, now: Optional[datetime] = None) -> bool:
+    # now 可由调用方整批传入，避免每行各取一次当前时间
     if updated_at.tzinfo is None:
         updated_at = updated_at.replace(tzinfo=timezone.utc)
-    return (datetime.now(timezone.utc) - updated_at) <= timedelta(seconds=fresh_secs)
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return (now - updated_at) <= timedelta(seconds=fresh_secs)
 
 # ---------------- 挂载拆分后的路由 ----------------
 from routers import user as user_router, admin as admin_router, ota as ota_router, rpc as rpc_router, alarm as alarm_router, auth as auth_router
@@ -56,22 +251,15 @@ app.include_router(alarm_router.router)
 Query real-time data by device serial number (including online status).
 """
 )
-async def get_realtime_by_sn(device_sn: str, user=Depends(get_current_user)):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
-    sql = text(f"""
-        SELECT {COLUMNS}
-        FROM ess_realtime_data r
-        JOIN devices d ON r.device_id = d.id
-        WHERE d.device_sn=:sn
-    """)
-    async with engine.connect() as conn:
-        row = (await conn.execute(sql, {"sn": device_sn})).mappings().first()
-        if not row:
-            raise HTTPException(status_code=404, detail="实时数据不存在")
-    d = dict(row)
-    d["online"] = online_flag(d["updated_at"], DEVICE_FRESH_SECS)
-    return d
+async def get_realtime_by_sn(device_sn: str, user=Depends(require_staff), conn=Depends(get_conn)):
+    row = (await conn.execute(
+        REALTIME_BY_SN_SQL,
+        {"sn": device_sn, "fresh": DEVICE_FRESH_SECS}
+    )).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="实时数据不存在")
+    # online 已在 SQL 中算好 | online comes computed from the query
+    return dict(row)
 
 # ---------------- 历史能耗聚合 ----------------
 
@@ -95,7 +283,8 @@ class HistoryAggListResponse(BaseModel):
 
 @app.get(
     "/api/v1/history/admin/by_sn",
-    response_model=HistoryAggListResponse,
+    response_model=None,
+    responses={200: {"model": HistoryAggListResponse}},
     tags=["管理员/客服 | Admin/Service"],
     summary="管理员按设备SN查询历史能耗聚合数据",
     description="""
@@ -120,44 +309,36 @@ async def admin_history_by_sn(
     date: Optional[date] = Query(None, description="指定日期（YYYY-MM-DD），按该日期按小时聚合，优先于period | Specific date (YYYY-MM-DD), aggregate by hour for that day, takes precedence over period"),
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=200, description="每页数量"),
-    admin=Depends(get_current_user)
+    admin=Depends(require_staff)
 ):
-    # 只允许管理员和客服访问
-    if admin["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
     async with engine.connect() as conn:
         device_row = (await conn.execute(
-            text("SELECT id, device_sn FROM devices WHERE device_sn=:sn"),
+            DEVICE_BY_SN_SQL,
             {"sn": device_sn}
         )).mappings().first()
         if not device_row:
             raise HTTPException(status_code=404, detail="设备不存在")
         device_id = device_row["id"]
-        device_sn_map = {device_id: device_sn}
     now = datetime.now(timezone.utc)
     if date:
         start = datetime.combine(date, dtime.min).replace(tzinfo=timezone.utc)
         end = datetime.combine(date, dtime.max).replace(tzinfo=timezone.utc)
-        group_expr = "date_trunc('hour', ts)"
         group_label = "hour"
     else:
         # 同上 period 逻辑
         if period == "today":
             start = now.replace(hour=0, minute=0, second=0, microsecond=0)
             end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            group_expr = "date_trunc('hour', ts)"
             group_label = "hour"
         elif period == "week":
             start_of_week = now - timedelta(days=now.weekday())
             start = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
             end = start + timedelta(days=6, hours=23, minutes=59, seconds=59, microseconds=999999)
-            group_expr = "date_trunc('day', ts)"
             group_label = "day"
         elif period == "month":
             start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             next_month = (now.replace(day=28) + timedelta(days=4)).replace(day=1)
             end = next_month - timedelta(seconds=1)
-            group_expr = "date_trunc('day', ts)"
             group_label = "day"
         elif period == "quarter":
             quarter = (now.month - 1) // 3 + 1
@@ -166,62 +347,27 @@ async def admin_history_by_sn(
             end_month = quarter * 3
             next_quarter = start.replace(month=end_month + 1, day=1) if end_month < 12 else start.replace(year=start.year + 1, month=1, day=1)
             end = next_quarter - timedelta(seconds=1)
-            group_expr = "date_trunc('month', ts)"
             group_label = "month"
         elif period == "year":
             start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
             end = now.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
-            group_expr = "date_trunc('month', ts)"
             group_label = "month"
         else:
             raise HTTPException(status_code=400, detail="无效的 period 值")
-    params = {"id0": device_id, "start": start, "end": end}
-    where = ["device_id = :id0", "ts >= :start", "ts <= :end"]
-    cond = "WHERE " + " AND ".join(where) if where else ""
-    offset = (page - 1) * page_size
+    params = {"id0": device_id, "start": start, "end": end,
+              "limit": page_size, "offset": (page - 1) * page_size}
+    query_sql = _ADMIN_HISTORY_SQL[group_label]
+
     async with engine.connect() as conn:
-        count_sql = text(f"""
-            SELECT COUNT(*) FROM (
-                SELECT {group_expr} AS {group_label}, device_id
-                FROM history_energy
-                {cond}
-                GROUP BY device_id, {group_label}
-            ) t
-        """)
-        query_sql = text(f"""
-            SELECT
-                device_id,
-                {group_expr} AS {group_label},
-                SUM(charge_wh_total) AS charge_wh_total,
-                SUM(discharge_wh_total) AS discharge_wh_total,
-                SUM(pv_wh_total) AS pv_wh_total,
-                SUM(grid_wh_total) AS grid_wh_total,
-                SUM(load_wh_total) AS load_wh_total      -- 新增
-            FROM history_energy
-            {cond}
-            GROUP BY device_id, {group_label}
-            ORDER BY {group_label} DESC
-            LIMIT :limit OFFSET :offset
-        """)
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
+        rows = (await conn.execute(query_sql, params)).mappings().all()
+    total = rows[0]["__total"] if rows else 0
     items = []
+    # 非当前粒度的列已在 SQL 里置 NULL，无需逐行归一化
+    # Inactive granularity columns are NULL straight from SQL
     for r in rows:
         d = dict(r)
-        d["device_sn"] = device_sn_map.get(d["device_id"], "")
-        # 只保留当前聚合粒度的字段
-        if group_label == "hour":
-            d["hour"] = d.pop("hour")
-            d["day"] = None
-            d["month"] = None
-        elif group_label == "day":
-            d["day"] = d.pop("day")
-            d["hour"] = None
-            d["month"] = None
-        elif group_label == "month":
-            d["month"] = d.pop("month")
-            d["hour"] = None
-            d["day"] = None
+        d.pop("__total")
+        d["device_sn"] = device_sn
         items.append(d)
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
@@ -245,114 +391,71 @@ Admin and service only. Returns database connection count, active connections, s
 - 历史慢SQL统计 | Historical slow SQL stats
 """
 )
-async def db_metrics(user=Depends(get_current_user)):
-    # 只允许管理员和客服访问
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限")
-
-    async with engine.connect() as conn:
-        # 当前连接数
-        conn_count = (await conn.execute(text("SELECT count(*) FROM pg_stat_activity"))).scalar_one()
-
-        def safe_dict(row):
-            d = dict(row)
-            if "client_addr" in d and d["client_addr"] is not None:
-                d["client_addr"] = str(d["client_addr"])
-            if "duration" in d and d["duration"] is not None:
-                d["duration"] = str(d["duration"])
-            return d
-
-        # 活跃连接详情（非 idle）
-        active_sql = text("""
-            SELECT pid, usename, application_name, client_addr, state, query, now() - query_start AS duration
-            FROM pg_stat_activity
-            WHERE state != 'idle'
-            ORDER BY duration DESC
-            LIMIT 20
-        """)
-        active_rows = (await conn.execute(active_sql)).mappings().all()
-        active_connections = [safe_dict(row) for row in active_rows]
-
-        # 慢查询（运行超过5秒的）
-        slow_sql = text("""
-            SELECT pid, usename, application_name, client_addr, state, query, now() - query_start AS duration
-            FROM pg_stat_activity
-            WHERE state != 'idle' AND now() - query_start > interval '5 seconds'
-            ORDER BY duration DESC
-            LIMIT 20
-        """)
-        slow_rows = (await conn.execute(slow_sql)).mappings().all()
-        slow_queries = [safe_dict(row) for row in slow_rows]
-
-        # 数据库总大小
-        db_size = (await conn.execute(text("SELECT pg_size_pretty(pg_database_size(current_database()))"))).scalar_one()
-
-        # 每个表的大小（前10大表）
-        table_sizes = (await conn.execute(text("""
-            SELECT relname AS table, pg_size_pretty(pg_total_relation_size(relid)) AS size
-            FROM pg_catalog.pg_statio_user_tables
-            ORDER BY pg_total_relation_size(relid) DESC
-            LIMIT 10
-        """))).mappings().all()
-        table_sizes = [dict(row) for row in table_sizes]
-
-        # 缓存命中率
-        hit_rate = (await conn.execute(text("""
-            SELECT
-                ROUND(SUM(blks_hit) / NULLIF(SUM(blks_hit) + SUM(blks_read),0)::numeric, 4) AS hit_rate
-            FROM pg_stat_database
-        """))).scalar_one()
-
-        # 死锁数
-        deadlocks = (await conn.execute(text("""
-            SELECT SUM(deadlocks) FROM pg_stat_database
-        """))).scalar_one()
-
-        # 事务数（当前活跃事务数）
-        tx_count = (await conn.execute(text("""
-            SELECT count(*) FROM pg_stat_activity WHERE state = 'active'
-        """))).scalar_one()
-
-        # 当前等待的查询数
-        waiting_count = (await conn.execute(text("""
-            SELECT count(*) FROM pg_stat_activity WHERE wait_event IS NOT NULL
-        """))).scalar_one()
-
-        # 数据库启动时间
-        start_time = (await conn.execute(text("""
-            SELECT pg_postmaster_start_time()
-        """))).scalar_one()
-
-        # 服务器版本
-        version = (await conn.execute(text("SHOW server_version"))).scalar_one()
-
-        # 最大连接数
-        max_conn = (await conn.execute(text("SHOW max_connections"))).scalar_one()
-
-        # 当前空闲连接数
-        idle_conn = (await conn.execute(
-            text("SELECT count(*) FROM pg_stat_activity WHERE state = 'idle'")
-        )).scalar_one()
-
-        # 历史慢SQL统计（PostgreSQL 13+ 字段）
+async def db_metrics(user=Depends(require_admin_or_service)):
+
+    def safe_dict(row):
+        d = dict(row)
+        if "client_addr" in d and d["client_addr"] is not None:
+            d["client_addr"] = str(d["client_addr"])
+        if "duration" in d and d["duration"] is not None:
+            d["duration"] = str(d["duration"])
+        return d
+
+    # 各项指标互相独立，用 gather 在多个池连接上并发执行，
+    # 总耗时从各查询之和降为最慢一条的耗时
+    # The metrics are independent; gather them on separate pooled
+    # connections so wall time is max(t_i) instead of the sum
+    async def _fetch(sql):
+        async with engine.connect() as conn:
+            return await conn.execute(sql)
+
+    async def _fetch_stat_statements():
+        # pg_stat_statements 未安装时单独失败，不影响其它查询
+        # Missing pg_stat_statements fails in isolation on its own connection
         try:
-            stat_sql = text("""
-                SELECT
-                    query,
-                    calls,
-                    total_exec_time,
-                    mean_exec_time,
-                    max_exec_time
-                FROM pg_stat_statements
-                WHERE calls > 10
-                ORDER BY mean_exec_time DESC
-                LIMIT 10
-            """)
-            stat_rows = (await conn.execute(stat_sql)).mappings().all()
-            slow_sql_history = [dict(row) for row in stat_rows]
+            async with engine.connect() as conn:
+                stat_rows = (await conn.execute(_PG_STAT_STATEMENTS_SQL)).mappings().all()
+            return [dict(row) for row in stat_rows]
         except Exception:
-            await conn.rollback()
-            slow_sql_history = []
+            return []
+
+    (
+        summary_res, active_res, db_size_res, table_sizes_res,
+        hit_rate_res, deadlocks_res, start_time_res,
+        version_res, max_conn_res, slow_sql_history,
+    ) = await asyncio.gather(
+        _fetch(_PG_ACTIVITY_SUMMARY_SQL),
+        _fetch(_PG_ACTIVE_SQL),
+        _fetch(_PG_DB_SIZE_SQL),
+        _fetch(_PG_TABLE_SIZES_SQL),
+        _fetch(_PG_HIT_RATE_SQL),
+        _fetch(_PG_DEADLOCKS_SQL),
+        _fetch(_PG_START_TIME_SQL),
+        _fetch(_PG_VERSION_SQL),
+        _fetch(_PG_MAX_CONN_SQL),
+        _fetch_stat_statements(),
+    )
+
+    summary = summary_res.mappings().one()
+    conn_count = summary["conn_count"]
+    tx_count = summary["tx_count"]
+    idle_conn = summary["idle_conn"]
+    waiting_count = summary["waiting_count"]
+    active_rows = active_res.mappings().all()
+    active_connections = [safe_dict(row) for row in active_rows]
+    # 活跃列表按耗时倒序，>5s 的慢查询就是它的前缀，无需再扫一遍视图
+    # The active list is sorted by duration, so slow queries are its prefix
+    slow_queries = [
+        safe_dict(row) for row in active_rows
+        if row["duration"] is not None and row["duration"] > timedelta(seconds=5)
+    ]
+    db_size = db_size_res.scalar_one()
+    table_sizes = [dict(row) for row in table_sizes_res.mappings().all()]
+    hit_rate = hit_rate_res.scalar_one()
+    deadlocks = deadlocks_res.scalar_one()
+    start_time = start_time_res.scalar_one()
+    version = version_res.scalar_one()
+    max_conn = max_conn_res.scalar_one()
 
     result = {
         "connection_count": conn_count,
@@ -370,49 +473,64 @@ async def db_metrics(user=Depends(get_current_user)):
         "idle_connections": idle_conn,
         "slow_sql_history": slow_sql_history
     }
-    return JSONResponse(convert_decimal(result))
-
-def convert_decimal(obj):
-    if isinstance(obj, list):
-        return [convert_decimal(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_decimal(v) for k, v in obj.items()}
-    elif isinstance(obj, decimal.Decimal):
-        # 你可以根据实际情况转 float 或 int
+    return Response(content=orjson.dumps(result, default=_json_default), media_type="application/json")
+
+def _json_default(obj):
+    # orjson 序列化时只对遇到的 Decimal 做转换，无需预先递归遍历整棵结果树
+    if isinstance(obj, decimal.Decimal):
         return float(obj)
-    else:
-        return obj
+    return str(obj)
 
 async def cleanup_alarm_history():
-    while True:
-        await asyncio.sleep(86400)  # 每天运行一次
-        try:
-            cutoff = datetime.now(timezone.utc) - timedelta(days=ALARM_HISTORY_RETENTION_DAYS)
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=ALARM_HISTORY_RETENTION_DAYS)
+        while True:
             async with engine.begin() as conn:
-                await conn.execute(
-                    text("DELETE FROM alarm_history WHERE archived_at < :cutoff"),
-                    {"cutoff": cutoff}
+                result = await conn.execute(
+                    CLEANUP_ALARM_HISTORY_SQL,
+                    {"cutoff": cutoff, "batch": _CLEANUP_BATCH}
                 )
-        except Exception as e:
-            print(f"清理历史报警失败: {e}")
+            if result.rowcount < _CLEANUP_BATCH:
+                break
+    except Exception as e:
+        print(f"清理历史报警失败: {e}")
 
 async def cleanup_rpc_logs():
-    while True:
-        await asyncio.sleep(86400)  # 每天运行一次
-        try:
-            cutoff = datetime.now(timezone.utc) - timedelta(days=RPC_LOG_RETENTION_DAYS)
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=RPC_LOG_RETENTION_DAYS)
+        while True:
             async with engine.begin() as conn:
-                await conn.execute(
-                    text("DELETE FROM device_rpc_change_log WHERE created_at < :cutoff"),
-                    {"cutoff": cutoff}
+                result = await conn.execute(
+                    CLEANUP_RPC_LOG_SQL,
+                    {"cutoff": cutoff, "batch": _CLEANUP_BATCH}
                 )
-        except Exception as e:
-            print(f"清理RPC日志失败: {e}")
+            if result.rowcount < _CLEANUP_BATCH:
+                break
+    except Exception as e:
+        print(f"清理RPC日志失败: {e}")
+
+# 清理任务改用 APScheduler 的 cron 触发：sleep(86400) 在进程被挂起/迁移后会
+# 偏移触发时间，且两个任务同时醒来争抢同一批连接；cron 按墙钟触发、错峰 5 分钟，
+# coalesce 把积压的错过触发合并成一次
+# Cleanup jobs fire on APScheduler cron triggers: asyncio.sleep(86400)
+# drifts when the process is suspended or migrated, and both tasks used to
+# wake at the same instant and contend for connections. Cron fires on wall
+# clock, staggered by 5 minutes; coalesce folds missed runs into one.
+scheduler = AsyncIOScheduler(timezone=timezone.utc)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(cleanup_rpc_logs())
-    asyncio.create_task(cleanup_alarm_history())
+    mqtt_client.start()
+    scheduler.add_job(cleanup_rpc_logs, CronTrigger(hour=2, minute=0),
+                      coalesce=True, misfire_grace_time=3600)
+    scheduler.add_job(cleanup_alarm_history, CronTrigger(hour=2, minute=5),
+                      coalesce=True, misfire_grace_time=3600)
+    scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    scheduler.shutdown(wait=False)
+    mqtt_client.stop()
 
 @app.get(
     "/api/v1/devices/online_summary",
@@ -429,32 +547,16 @@ Returns total devices, online devices, and offline devices. Devices with data re
 """
 )
 async def devices_online_summary(
-    user=Depends(get_current_user)
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
 
     fresh = 60  # 固定60秒
 
     async with engine.connect() as conn:
-        total_devices = (await conn.execute(
-            text("SELECT COUNT(*) FROM devices")
-        )).scalar_one()
+        total_devices = (await conn.execute(DEVICE_COUNT_SQL)).scalar_one()
 
         online_devices = (await conn.execute(
-            text("""
-                WITH latest AS (
-                  SELECT device_id, MAX(updated_at) AS updated_at
-                  FROM ess_realtime_data
-
-                  GROUP BY device_id
-                )
-                SELECT COUNT(*)
-                FROM devices d
-                LEFT JOIN latest r ON r.device_id = d.id
-                WHERE r.updated_at IS NOT NULL
-                  AND r.updated_at >= now() - make_interval(secs => :fresh)
-            """),
+            ONLINE_COUNT_SQL,
             {"fresh": fresh}
         )).scalar_one()
 
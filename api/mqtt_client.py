@@ -0,0 +1,80 @@
+"""常驻 MQTT 客户端 / Persistent MQTT client
+
+publish.single 每次发布都要完整走一遍 TCP 建连 + CONNECT/CONNACK + DISCONNECT，
+下发一条 RPC 的大头全在握手上。这里改为进程内维护一条长连接，
+发布只剩一个 PUBLISH 帧；连接由 paho 的后台网络线程维护并自动重连。
+
+publish.single pays a full TCP + MQTT CONNECT/CONNACK + DISCONNECT
+handshake per message. This module keeps one long-lived connection per
+process so a publish is just a PUBLISH frame; paho's network thread
+handles keepalive and automatic reconnects.
+"""
+import asyncio
+import paho.mqtt.client as mqtt
+from config import MQTT_HOST, MQTT_PORT
+
+# 与 ingestor 相同的版本兼容写法 | Same version-compat construction as the ingestor
+try:
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+except AttributeError:
+    client = mqtt.Client()
+
+
+# 发布经由有界队列交给后台任务，请求协程只负责入队即可返回；
+# 队列满（broker 长时间不可达）时 enqueue 会背压等待而不是无限堆积
+# Publishes go through a bounded queue drained by a background task, so
+# request coroutines return after enqueueing; a full queue back-pressures
+# instead of growing without bound
+_queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+_worker_task = None
+
+
+# 单次唤醒最多连发的消息数 | Max messages published per worker wake-up
+_BATCH_MAX = 64
+
+
+async def _worker():
+    while True:
+        batch = [await _queue.get()]
+        # 把队列里已就绪的消息一次取完，背靠背发布在同一条长连接上，
+        # 减少任务唤醒次数；不额外等待，避免给单条消息加延迟
+        # Drain whatever is already queued and publish back-to-back on the
+        # shared connection; no timed wait, so a lone message isn't delayed
+        while len(batch) < _BATCH_MAX:
+            try:
+                batch.append(_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        for topic, payload, qos in batch:
+            try:
+                client.publish(topic, payload, qos=qos)
+            except Exception as e:
+                print(f"MQTT发布失败: {e}")
+            finally:
+                _queue.task_done()
+
+
+def start():
+    """应用启动时调用：异步建连、启动后台网络线程和发布任务"""
+    global _worker_task
+    client.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+    client.loop_start()
+    _worker_task = asyncio.get_running_loop().create_task(_worker())
+
+
+def stop():
+    """应用关闭时调用"""
+    if _worker_task is not None:
+        _worker_task.cancel()
+    client.loop_stop()
+    client.disconnect()
+
+
+async def enqueue(topic: str, payload, qos: int = 0):
+    """入队待发布 | Queue a message for the background publisher"""
+    await _queue.put((topic, payload, qos))
+
+
+def publish(topic: str, payload, qos: int = 0):
+    """复用长连接发布一条消息 | Publish one message over the shared connection"""
+    return client.publish(topic, payload, qos=qos)
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
 from pydantic import BaseModel, Field
-from deps import get_current_user
-from main import engine, async_session
+from deps import require_admin
+from main import engine, async_session, resolve_device_id
 
 router = APIRouter(prefix="/api/v1/admin", tags=["管理员专用 | Admin Only"])
 
@@ -30,20 +30,17 @@ Admin only. Delete all alarm history records for the specified device.
 )
 async def admin_delete_alarm_history_by_sn(
     data: AdminBatchDeleteAlarmHistoryBySNRequest,
-    user=Depends(get_current_user)
+    user=Depends(require_admin)
 ):
-    if user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="仅管理员可用")
+    # SN -> id 走进程内缓存（映射不可变），命中时省掉一次 devices 查询
+    # The cached resolver skips the devices SELECT on hits; the mapping is immutable
+    device_id = await resolve_device_id(data.device_sn)
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="设备不存在")
     async with engine.begin() as conn:
-        device = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn"),
-            {"sn": data.device_sn}
-        )).first()
-        if not device:
-            raise HTTPException(status_code=404, detail="设备不存在")
         result = await conn.execute(
             text("DELETE FROM alarm_history WHERE device_id=:did"),
-            {"did": device.id}
+            {"did": device_id}
         )
     return {"msg": f"已删除设备 {data.device_sn} 的历史报警", "deleted_count": result.rowcount}
 
@@ -64,20 +61,15 @@ Admin only. Delete all RPC change logs for the specified device.
 )
 async def admin_delete_rpc_log_by_sn(
     data: AdminBatchDeleteRPCLogBySNRequest,
-    user=Depends(get_current_user)
+    user=Depends(require_admin)
 ):
-    if user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="仅管理员可用")
+    device_id = await resolve_device_id(data.device_sn)
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="设备不存在")
     async with engine.begin() as conn:
-        device = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn"),
-            {"sn": data.device_sn}
-        )).first()
-        if not device:
-            raise HTTPException(status_code=404, detail="设备不存在")
         result = await conn.execute(
             text("DELETE FROM device_rpc_change_log WHERE device_id=:did"),
-            {"did": device.id}
+            {"did": device_id}
         )
     return {"msg": f"已删除设备 {data.device_sn} 的RPC日志", "deleted_count": result.rowcount}
 
@@ -98,12 +90,18 @@ Admin only. Delete all alarm history records (system-wide).
 This operation will clear all devices' alarm history and is irreversible!
 """
 )
-async def admin_clear_all_alarm_history(user=Depends(get_current_user)):
-    if user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="仅管理员可用")
+async def admin_clear_all_alarm_history(user=Depends(require_admin)):
     async with engine.begin() as conn:
-        result = await conn.execute(text("DELETE FROM alarm_history"))
-    return {"msg": "已清空所有历史报警", "deleted_count": result.rowcount}
+        # TRUNCATE 只做文件级操作，WAL 极少且立即回收空间；行数在同一事务里
+        # 精确 COUNT 一次——一趟扫描仍远比逐行 DELETE 便宜
+        # TRUNCATE is file-level with minimal WAL and immediate space reclaim;
+        # the count is an exact COUNT(*) in the same transaction — one scan
+        # is still far cheaper than the old row-by-row DELETE
+        count = (await conn.execute(
+            text("SELECT COUNT(*) FROM alarm_history")
+        )).scalar_one()
+        await conn.execute(text("TRUNCATE TABLE alarm_history RESTART IDENTITY"))
+    return {"msg": "已清空所有历史报警", "deleted_count": count}
 
 # 管理员专用：清空所有RPC日志
 @router.delete(
@@ -122,9 +120,10 @@ Admin only. Delete all RPC change logs (system-wide).
 This operation will clear all devices' RPC logs and is irreversible!
 """
 )
-async def admin_clear_all_rpc_logs(user=Depends(get_current_user)):
-    if user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="仅管理员可用")
+async def admin_clear_all_rpc_logs(user=Depends(require_admin)):
     async with engine.begin() as conn:
-        result = await conn.execute(text("DELETE FROM device_rpc_change_log"))
-    return {"msg": "已清空所有RPC日志", "deleted_count": result.rowcount}
\ No newline at end of file
+        count = (await conn.execute(
+            text("SELECT COUNT(*) FROM device_rpc_change_log")
+        )).scalar_one()
+        await conn.execute(text("TRUNCATE TABLE device_rpc_change_log RESTART IDENTITY"))
+    return {"msg": "已清空所有RPC日志", "deleted_count": count}
\ No newline at end of file
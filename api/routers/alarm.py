@@ -1,12 +1,11 @@
 from typing import Optional, List, Any
-from datetime import datetime, timedelta
-import json
+from functools import lru_cache
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
 from sqlalchemy import text
-from deps import get_current_user
-from main import engine
-from config import DEVICE_FRESH_SECS
+from deps import require_admin_or_service, require_staff
+from main import engine, resolve_device_id
 
 router = APIRouter(prefix="/api/v1/alarms", tags=["报警管理 | Alarm Management"])
 
@@ -46,10 +45,90 @@ class AlarmConfirmBySNAndCodeRequest(BaseModel):
     device_sn: str
     code: int
 
+# 列表接口的显式列清单：直接在 SQL 里起别名 alarm_id，省掉 Python 逐行改名，
+# 也不再用 SELECT * 把响应用不到的列拖过网络
+# Explicit column list for list endpoints: aliasing id AS alarm_id in SQL
+# removes the per-row rename, and SELECT * no longer ships unused columns
+ALARM_LIST_COLS = """a.id AS alarm_id, a.device_id, a.alarm_type, a.code, a.level,
+            a.extra, a.status, a.first_triggered_at, a.last_triggered_at,
+            a.repeat_count, a.remark, a.confirmed_at, a.confirmed_by,
+            a.cleared_at, a.cleared_by"""
+
+# 不变的 SQL 构建一次（同 main.py）| Invariant SQL built once, as in main.py
+_BATCH_CONFIRM_SQL = text("""
+    UPDATE alarms
+    SET confirmed_at = now(), confirmed_by = :by
+    WHERE code = :code
+      AND confirmed_at IS NULL
+""")
+_UNHANDLED_TOTAL_SQL = text("""
+    SELECT COUNT(*) FROM alarms
+    WHERE status IN ('active', 'confirmed')
+""")
+_UNHANDLED_LEVEL_SQL = text("""
+    SELECT level, COUNT(*) AS count
+    FROM alarms
+    WHERE status IN ('active', 'confirmed')
+    GROUP BY level
+""")
+_CONFIRM_BY_SN_CODE_SQL = text("""
+    UPDATE alarms a
+    SET confirmed_at = now(), confirmed_by = :by
+    FROM devices d
+    WHERE d.device_sn = :sn AND a.device_id = d.id
+      AND a.code = :code
+      AND a.confirmed_at IS NULL
+""")
+_DEVICE_EXISTS_SQL = text("SELECT 1 FROM devices WHERE device_sn=:sn")
+# critical+cleared 的归档整条语句完成：DELETE ... RETURNING 喂给 INSERT ... SELECT，
+# 原来的 逐行查询+插入+删除（2N+1 次往返）收敛为 1 次，duration 也在 SQL 里算
+# Archive critical+cleared alarms in one statement: DELETE ... RETURNING feeds
+# INSERT ... SELECT, collapsing the per-row fetch/insert/delete loop (2N+1
+# round-trips) into one; duration is computed in SQL as well
+_ARCHIVE_CRITICAL_SQL = text("""
+    WITH moved AS (
+        DELETE FROM alarms a
+        USING devices d
+        WHERE d.device_sn = :sn AND a.device_id = d.id
+          AND a.code = :code
+          AND a.level = 'critical' AND a.status = 'cleared'
+        RETURNING a.*
+    )
+    INSERT INTO alarm_history (
+        device_id, device_sn, alarm_type, code, level, extra, status,
+        first_triggered_at, last_triggered_at, repeat_count, remark,
+        confirmed_at, confirmed_by, cleared_at, cleared_by, archived_at, duration
+    )
+    SELECT
+        device_id, device_sn, alarm_type, code, level, extra, status,
+        first_triggered_at, last_triggered_at, repeat_count, remark,
+        confirmed_at, confirmed_by, cleared_at, cleared_by, now(),
+        make_interval(secs => GREATEST(
+            1, EXTRACT(EPOCH FROM (last_triggered_at - first_triggered_at))::int
+        ))
+    FROM moved
+""")
+
+# 过滤组合有限，按 WHERE 子句缓存 text() 对象，语句文本稳定可复用编译缓存
+# Filter combinations are few; cache the text() per WHERE clause so the
+# statement object (and its compiled form) is reused across requests
+@lru_cache(maxsize=64)
+def _admin_alarm_page_sql(cond: str):
+    # device_sn 已冗余在 alarms 上（见 init/alarm.sql），无需再 JOIN devices
+    # device_sn is denormalized onto alarms (init/alarm.sql); no JOIN needed
+    return text(f"""
+        SELECT {ALARM_LIST_COLS}, a.device_sn, COUNT(*) OVER() AS __total
+        FROM alarms a
+        {cond}
+        ORDER BY a.first_triggered_at DESC, a.id DESC
+        LIMIT :limit OFFSET :offset
+    """)
+
 # 管理员/客服查询所有报警
 @router.get(
     "/admin",
-    response_model=AlarmListResponse,
+    response_model=None,
+    responses={200: {"model": AlarmListResponse}},
     summary="报警管理查询 | Query All Alarms (Admin/Service)",
     description="""
 **权限要求 | Required Role**: admin, service, support
@@ -67,50 +146,58 @@ async def list_all_alarms(
     level: Optional[str] = Query(None),
     code: Optional[int] = Query(None),
     alarm_type: Optional[str] = Query(None),
-    user=Depends(get_current_user)
+    before_ts: Optional[datetime] = Query(None, description="游标分页：与 before_id 配合，只返回更早的行 | Keyset cursor, used with before_id"),
+    before_id: Optional[int] = Query(None, description="游标分页：上一页最后一行的 alarm_id | Keyset cursor: last alarm_id of previous page"),
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
     where = []
     params = {}
-    join_sql = "LEFT JOIN devices d ON alarms.device_id = d.id"
     if device_sn:
-        where.append("d.device_sn = :device_sn")
-        params["device_sn"] = device_sn
+        # SN 先走进程内缓存换成 device_id，谓词直接命中 alarms 的复合索引
+        # Resolve SN to device_id via the cache so the predicate hits the
+        # composite alarms index
+        device_id = await resolve_device_id(device_sn)
+        if device_id is None:
+            return {"items": [], "page": page, "page_size": page_size, "total": 0, "next_cursor": None}
+        where.append("a.device_id = :did")
+        params["did"] = device_id
     if status:
-        where.append("alarms.status = :status")
+        where.append("a.status = :status")
         params["status"] = status
     if level:
-        where.append("alarms.level = :level")
+        where.append("a.level = :level")
         params["level"] = level
     if code:
-        where.append("alarms.code = :code")
+        where.append("a.code = :code")
         params["code"] = code
     if alarm_type:
-        where.append("alarms.alarm_type = :alarm_type")
+        where.append("a.alarm_type = :alarm_type")
         params["alarm_type"] = alarm_type
+    # 传入游标时走键集分页，深页不再扫描丢弃 OFFSET 行（同用户端报警列表）
+    # With a cursor, keyset pagination replaces deep OFFSET scans, as in the
+    # user-facing alarm lists
+    if before_ts is not None and before_id is not None:
+        where.append("(a.first_triggered_at, a.id) < (:before_ts, :before_id)")
+        params["before_ts"] = before_ts
+        params["before_id"] = before_id
+        params["offset"] = 0
+    else:
+        params["offset"] = (page - 1) * page_size
     cond = "WHERE " + " AND ".join(where) if where else ""
-    offset = (page - 1) * page_size
 
     async with engine.connect() as conn:
-        count_sql = text(f"SELECT COUNT(*) FROM alarms {join_sql} {cond}")
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        query_sql = text(f"""
-            SELECT alarms.*, d.device_sn
-            FROM alarms
-            {join_sql}
-            {cond}
-            ORDER BY alarms.first_triggered_at DESC
-            LIMIT :limit OFFSET :offset
-        """)
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
+        rows = (await conn.execute(_admin_alarm_page_sql(cond), {**params, "limit": page_size})).mappings().all()
+        total = rows[0]["__total"] if rows else 0
         items = []
         for row in rows:
             d = dict(row)
-            d["alarm_id"] = d.pop("id")
-            # device_sn 字段已包含在 row 里，无需额外处理
+            d.pop("__total")
             items.append(d)
-    return {"items": items, "page": page, "page_size": page_size, "total": total}
+    next_cursor = (
+        {"before_ts": items[-1]["first_triggered_at"], "before_id": items[-1]["alarm_id"]}
+        if len(items) == page_size else None
+    )
+    return {"items": items, "page": page, "page_size": page_size, "total": total, "next_cursor": next_cursor}
 
 # 按code批量确认报警
 @router.post(
@@ -126,18 +213,14 @@ Admin/Service can batch confirm all unconfirmed alarms by code (only operates on
 )
 async def batch_confirm_alarm_by_code(
     data: AlarmBatchConfirmByCodeRequest,
-    user=Depends(get_current_user)
+    user=Depends(require_admin_or_service)
 ):
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限")
-    async with engine.begin() as conn:
+    # 单条 UPDATE 用自动提交，省掉 BEGIN/COMMIT 两次往返
+    # Single UPDATE runs in autocommit, skipping the BEGIN/COMMIT round-trips
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
         result = await conn.execute(
-            text("""
-                UPDATE alarms
-                SET confirmed_at = now(), confirmed_by = :by
-                WHERE code = :code
-                  AND confirmed_at IS NULL
-            """),
+            _BATCH_CONFIRM_SQL,
             {"code": data.code, "by": user["username"]}
         )
     return {"msg": f"已确认所有 code={data.code} 的报警", "confirmed_count": result.rowcount}
@@ -154,22 +237,10 @@ async def batch_confirm_alarm_by_code(
 Admin/Service/Support only. Count total and per-level unhandled (active/confirmed) alarms.
 """
 )
-async def count_unhandled_alarms(user=Depends(get_current_user)):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
+async def count_unhandled_alarms(user=Depends(require_staff)):
     async with engine.connect() as conn:
-        total_sql = text("""
-            SELECT COUNT(*) FROM alarms
-            WHERE status IN ('active', 'confirmed')
-        """)
-        total_count = (await conn.execute(total_sql)).scalar_one()
-        level_sql = text("""
-            SELECT level, COUNT(*) AS count
-            FROM alarms
-            WHERE status IN ('active', 'confirmed')
-            GROUP BY level
-        """)
-        rows = (await conn.execute(level_sql)).mappings().all()
+        total_count = (await conn.execute(_UNHANDLED_TOTAL_SQL)).scalar_one()
+        rows = (await conn.execute(_UNHANDLED_LEVEL_SQL)).mappings().all()
         level_counts = {row["level"]: row["count"] for row in rows}
     return {
         "unhandled_alarm_count": total_count,
@@ -192,87 +263,29 @@ Critical level cleared alarms will be automatically archived to alarm_history ta
 )
 async def confirm_alarm_by_sn_and_code(
     data: AlarmConfirmBySNAndCodeRequest,
-    user=Depends(get_current_user)
+    user=Depends(require_admin_or_service)
 ):
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限")
     async with engine.begin() as conn:
-        device_row = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn"),
-            {"sn": data.device_sn}
-        )).mappings().first()
-        if not device_row:
-            raise HTTPException(status_code=404, detail="设备不存在")
-        device_id = device_row["id"]
-
+        # 设备查找合并进 UPDATE（FROM devices），happy path 少一次往返；
+        # 仅在一行未更新时才补查设备以区分 404
+        # Device lookup folded into the UPDATE via FROM devices; probe the
+        # device only when nothing was updated, to disambiguate the 404
         result = await conn.execute(
-            text("""
-                UPDATE alarms
-                SET confirmed_at = now(), confirmed_by = :by
-                WHERE device_id = :device_id AND code = :code
-                AND confirmed_at IS NULL
-            """),
-            {"device_id": device_id, "code": data.code, "by": user["username"]}
+            _CONFIRM_BY_SN_CODE_SQL,
+            {"sn": data.device_sn, "code": data.code, "by": user["username"]}
         )
 
-        critical_cleared_alarms = await conn.execute(
-            text("""
-                SELECT *
-                FROM alarms
-                WHERE device_id = :device_id AND code = :code
-                AND level = 'critical' AND status = 'cleared'
-            """),
-            {"device_id": device_id, "code": data.code}
+        archived = await conn.execute(
+            _ARCHIVE_CRITICAL_SQL,
+            {"sn": data.device_sn, "code": data.code}
         )
-        rows = critical_cleared_alarms.mappings().all()
-
-        for row in rows:
-            cleared_at = row["cleared_at"]
-            first_triggered_at = row["first_triggered_at"]
-            last_triggered_at = row["last_triggered_at"]
-
-            if last_triggered_at and first_triggered_at:
-                duration = max(1, int((last_triggered_at - first_triggered_at).total_seconds()))
-            else:
-                duration = None
-
-            extra = json.dumps(row["extra"]) if isinstance(row["extra"], dict) else row["extra"]
-            duration = timedelta(seconds=duration) if duration else None
-
-            await conn.execute(
-                text("""
-                    INSERT INTO alarm_history (
-                        device_id, alarm_type, code, level, extra, status,
-                        first_triggered_at, last_triggered_at, repeat_count, remark,
-                        confirmed_at, confirmed_by, cleared_at, cleared_by, archived_at, duration
-                    ) VALUES (
-                        :device_id, :alarm_type, :code, :level, :extra, :status,
-                        :first_triggered_at, :last_triggered_at, :repeat_count, :remark,
-                        :confirmed_at, :confirmed_by, :cleared_at, :cleared_by, now(), :duration
-                    )
-                """),
-                {
-                    "device_id": row["device_id"],
-                    "alarm_type": row["alarm_type"],
-                    "code": row["code"],
-                    "level": row["level"],
-                    "extra": extra,
-                    "status": row["status"],
-                    "first_triggered_at": row["first_triggered_at"],
-                    "last_triggered_at": row["last_triggered_at"],
-                    "repeat_count": row["repeat_count"],
-                    "remark": row["remark"],
-                    "confirmed_at": row["confirmed_at"],
-                    "confirmed_by": row["confirmed_by"],
-                    "cleared_at": row["cleared_at"],
-                    "cleared_by": row["cleared_by"],
-                    "duration": duration,
-                }
-            )
 
-            await conn.execute(
-                text("DELETE FROM alarms WHERE id = :id"),
-                {"id": row["id"]}
-            )
+        if result.rowcount == 0 and archived.rowcount == 0:
+            device_exists = (await conn.execute(
+                _DEVICE_EXISTS_SQL,
+                {"sn": data.device_sn}
+            )).first()
+            if not device_exists:
+                raise HTTPException(status_code=404, detail="设备不存在")
 
     return {"msg": f"已确认设备 {data.device_sn} code={data.code} 的所有报警", "confirmed_count": result.rowcount}
\ No newline at end of file
@@ -1,3 +1,4 @@
+import asyncio
 import bcrypt
 import jwt
 from datetime import datetime, timezone, timedelta
@@ -9,7 +10,7 @@ from pydantic import BaseModel, EmailStr, Field
 from sqlalchemy import text
 from main import engine
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, EMAIL_CODE_EXPIRE_MINUTES
-from deps import bearer_scheme, get_current_user  # 使用统一的 bearer_scheme
+from deps import bearer_scheme, get_current_user, get_user_info, set_user_info  # 使用统一的 bearer_scheme
 
 router = APIRouter(prefix="/api/v1", tags=["鉴权 | Authentication"])
 
@@ -55,37 +56,33 @@ Send registration verification code to the specified email, valid for 5 minutes.
 """
 )
 async def send_email_code_register(data: EmailCodeRequest):
-    # 检查邮箱是否已注册
-    async with engine.connect() as conn:
-        result = await conn.execute(
-            text("SELECT 1 FROM users WHERE email=:email"),
-            {"email": data.email}
-        )
-        if result.first():
-            raise HTTPException(
-                status_code=400,
-                detail={"msg": "该邮箱已注册", "msg_en": "This email is already registered"}
-            )
-    
     # 生成6位验证码
     code = f"{randint(100000, 999999)}"
     expires_at = datetime.now(timezone.utc) + timedelta(minutes=EMAIL_CODE_EXPIRE_MINUTES)
-    
-    # 写入数据库
+
+    # 已注册检查和写码合成一条语句：原子拒绝已注册邮箱，往返 2 次 → 1 次
+    # Existence check and insert in one statement: registered emails are
+    # rejected atomically and round trips drop from 2 to 1
     async with engine.begin() as conn:
-        await conn.execute(
+        row = (await conn.execute(
             text("""
                 INSERT INTO email_codes (email, code, purpose, expires_at)
-                VALUES (:email, :code, :purpose, :expires_at)
+                SELECT :email, :code, 'register', :expires_at
+                WHERE NOT EXISTS (SELECT 1 FROM users WHERE email=:email)
+                RETURNING id
             """),
             {
                 "email": data.email,
                 "code": code,
-                "purpose": "register",
                 "expires_at": expires_at
             }
+        )).first()
+    if not row:
+        raise HTTPException(
+            status_code=400,
+            detail={"msg": "该邮箱已注册", "msg_en": "This email is already registered"}
         )
-    
+
     # 测试环境直接返回验证码（生产环境应发送邮件）
     return {
         "msg": "验证码已生成（测试环境直接返回）",
@@ -134,37 +131,42 @@ async def register(data: RegisterRequest):
         if code_row["code"] != data.code:
             raise HTTPException(status_code=400, detail="验证码错误")
         
-        # 检查邮箱是否已注册
-        exists = (await conn.execute(
-            text("SELECT 1 FROM users WHERE email=:email"),
-            {"email": data.email}
-        )).first()
-        if exists:
-            raise HTTPException(status_code=400, detail="邮箱已注册")
-        
-        # 创建用户
-        hashed = bcrypt.hashpw(data.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-        await conn.execute(
+        # 创建用户；bcrypt 是上百毫秒的纯 CPU 计算，放到线程池里算，避免卡住事件循环
+        # bcrypt hashing is a ~100ms CPU burn; run it in a thread so the
+        # event loop keeps serving other requests
+        hashed = (await asyncio.to_thread(
+            bcrypt.hashpw, data.password.encode("utf-8"), bcrypt.gensalt()
+        )).decode("utf-8")
+
+        # 插入、唯一性检查、标记验证码合并为一条语句：唯一约束天然防并发注册，
+        # 验证码只在注册成功时消耗（3 次往返 → 1 次）
+        # One statement replaces exists-check + insert + code update: the
+        # unique constraint handles races atomically and the code is only
+        # consumed when the insert actually happens (3 round trips -> 1)
+        inserted = (await conn.execute(
             text("""
-                INSERT INTO users (username, email, password_hash, role)
-                VALUES (:username, :email, :password_hash, 'user')
+                WITH ins AS (
+                    INSERT INTO users (username, email, password_hash, role)
+                    VALUES (:username, :email, :password_hash, 'user')
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING id
+                ), mark AS (
+                    UPDATE email_codes
+                    SET used=true
+                    WHERE email=:email AND purpose='register' AND code=:code
+                      AND EXISTS (SELECT 1 FROM ins)
+                )
+                SELECT id FROM ins
             """),
             {
                 "username": data.username,
                 "email": data.email,
-                "password_hash": hashed
+                "password_hash": hashed,
+                "code": data.code
             }
-        )
-        
-        # 标记验证码已使用
-        await conn.execute(
-            text("""
-                UPDATE email_codes
-                SET used=true
-                WHERE email=:email AND purpose='register' AND code=:code
-            """),
-            {"email": data.email, "code": data.code}
-        )
+        )).first()
+        if not inserted:
+            raise HTTPException(status_code=400, detail="邮箱已注册")
     
     return {"msg": "注册成功", "msg_en": "Registration successful"}
 
@@ -204,13 +206,18 @@ async def login(data: LoginRequest):
                 detail={"msg": "邮箱或密码错误", "msg_en": "Invalid email or password"}
             )
         
-        if not bcrypt.checkpw(data.password.encode("utf-8"), user_row["password_hash"].encode("utf-8")):
+        # 校验同样放线程池，理由同注册 | Offloaded for the same reason as register
+        ok = await asyncio.to_thread(
+            bcrypt.checkpw, data.password.encode("utf-8"), user_row["password_hash"].encode("utf-8")
+        )
+        if not ok:
             raise HTTPException(status_code=401, detail="邮箱或密码错误")
     
     # 生成 JWT Token
     payload = {
         "user_id": user_row["id"],
         "username": user_row["username"],
+        "email": user_row["email"],
         "role": user_row["role"],
         "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     }
@@ -227,6 +234,8 @@ async def login(data: LoginRequest):
 
 # ==================== 获取当前用户信息 ====================
 
+_GET_INFO_SQL = text("SELECT username, email, role FROM users WHERE id=:uid")
+
 @router.get(
     "/getinfo",
     summary="获取当前用户信息 | Get Current User Info",
@@ -243,22 +252,35 @@ Return basic info of the current logged-in user.
 )
 async def get_info(user=Depends(get_current_user)):
     """使用统一的 get_current_user 依赖"""
-    user_id = user["user_id"]
-    
-    async with engine.connect() as conn:
-        result = await conn.execute(
-            text("SELECT username, email, role FROM users WHERE id=:uid"),
-            {"uid": user_id}
-        )
-        row = result.first()
-        if not row:
-            raise HTTPException(status_code=404, detail="用户不存在")
-        info = row._mapping
+    # 登录时签发的 Token 已携带 username/email/role，直接回填即可，
+    # 零数据库往返；资料变更最晚在 Token 过期后生效（与各处角色判断一致）。
+    # 本次变更前签发的 Token 没有 email 声明（有效期长达 70 天），
+    # 这类旧 Token 走用户信息缓存兜底，未命中再查库并回填缓存
+    # The token minted at login already carries username/email/role, so this
+    # is served with zero DB round trips; profile changes take effect at
+    # token expiry at the latest, same as the role checks elsewhere.
+    # Tokens minted before this change lack the email claim (and live up to
+    # 70 days); those fall back to the user-info cache, then the DB.
+    if "email" in user:
         return {
-            "username": info["username"],
-            "email": info["email"],
-            "role": info["role"]
+            "username": user["username"],
+            "email": user["email"],
+            "role": user["role"],
         }
+    uid = user["user_id"]
+    info = await get_user_info(uid)
+    if info is None:
+        async with engine.connect() as conn:
+            row = (await conn.execute(_GET_INFO_SQL, {"uid": uid})).mappings().first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="用户不存在")
+        info = dict(row)
+        await set_user_info(uid, info)
+    return {
+        "username": info["username"],
+        "email": info["email"],
+        "role": info["role"],
+    }
 
 # ==================== 用户登出 ====================
 
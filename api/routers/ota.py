@@ -6,7 +6,7 @@ from typing import Optional
 from fastapi import APIRouter, Query, HTTPException, Depends, UploadFile, File
 from pydantic import BaseModel
 from sqlalchemy import text
-from deps import get_current_user
+from deps import require_admin_or_service, require_staff
 from main import engine
 from config import FIRMWARE_DIR
 
@@ -37,10 +37,8 @@ async def upload_firmware(
     notes: Optional[str] = Query(None, description="简短备注"),
     release_notes: Optional[str] = Query(None, description="详细发布说明（Markdown）"),
     file: UploadFile = File(...),
-    user=Depends(get_current_user)
+    user=Depends(require_admin_or_service)
 ):
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限 | Forbidden")
     if status not in {"draft", "testing", "released", "deprecated"}:
         raise HTTPException(status_code=400, detail="状态非法 | Invalid status")
     if not file.filename.lower().endswith(".bin"):
@@ -284,10 +282,8 @@ async def list_firmware(
     include_inactive: bool = Query(False, description="是否包含 is_active=false"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
-    user=Depends(get_current_user)
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限 | Forbidden")
     if status and status not in {"draft", "testing", "released", "deprecated"}:
         raise HTTPException(status_code=400, detail="状态非法 | Invalid status")
     device_type = device_type.strip().upper()
@@ -333,10 +329,8 @@ async def list_firmware(
 )
 async def delete_firmware(
     firmware_id: int,
-    user=Depends(get_current_user)
+    user=Depends(require_admin_or_service)
 ):
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限 | Forbidden")
 
     async with engine.begin() as conn:
         row = (await conn.execute(
@@ -398,10 +392,8 @@ async def list_firmware_audit(
     device_type: Optional[str] = Query(None, description="设备类型，如 ESP32"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
-    user=Depends(get_current_user)
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限 | Forbidden")
 
     filters = []
     params = {"limit": page_size, "offset": (page - 1) * page_size}
@@ -1,16 +1,15 @@
-import os
-import json
-import time
-import random
-import string
-from datetime import datetime
+import orjson
+import secrets
+from datetime import datetime, timezone
 from typing import Optional, List
+from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
 from sqlalchemy import text
-import paho.mqtt.publish as publish
-from deps import get_current_user
-from main import engine
+from cachetools import TTLCache
+import mqtt_client
+from deps import get_current_user, require_admin_or_service, require_staff
+from main import engine, resolve_device_id
 
 router = APIRouter(prefix="/api/v1/device", tags=["RPC管理 | RPC Management"])
 
@@ -43,6 +42,25 @@ class RPCLogListResponse(BaseModel):
 # 用户 RPC 参数白名单
 USER_RPC_ALLOWED = {"control_mode"}
 
+# 不变的 SQL 构建一次（同 main.py），两个下发接口共用同一条插入语句
+# Invariant SQL built once, as in main.py; both dispatch endpoints share the insert
+_USER_DEVICE_SQL = text("SELECT id FROM devices WHERE device_sn=:sn AND user_id=:uid")
+_INSERT_RPC_LOG_SQL = text("""
+    INSERT INTO device_rpc_change_log (
+      device_id, operator, request_id, para_name, para_value, status, message
+    ) VALUES (
+      :device_id, :operator, :request_id, :para_name, :para_value, 'pending', :message
+    )
+""")
+_DEVICE_PARA_SQL = text("SELECT device_id, para, updated_at FROM device_para WHERE device_id=:id")
+
+# 设备参数读多改少，按 SN 做短 TTL 进程内缓存（同 main.py 的 TTLCache 风格）；
+# 下发参数后主动失效，等设备回写新值后重新读库
+# Device params are read-heavy and low-volatility: short per-SN TTL cache in
+# the main.py TTLCache style, invalidated on dispatch so the next read hits
+# the DB once the device has written back
+_device_para_cache = TTLCache(maxsize=10000, ttl=60)
+
 # 用户端 RPC 下发
 @router.post(
     "/user_rpc_change",
@@ -71,26 +89,23 @@ async def user_rpc_change(
         raise HTTPException(status_code=403, detail=f"不允许修改参数: {req.para_name}")
 
     async with engine.begin() as conn:
-        device_row = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn AND user_id=:uid"),
+        device_id = (await conn.execute(
+            _USER_DEVICE_SQL,
             {"sn": req.device_sn, "uid": user["user_id"]}
-        )).mappings().first()
-        if not device_row:
+        )).scalar_one_or_none()
+        if device_id is None:
             raise HTTPException(status_code=404, detail="设备不存在或不属于当前用户")
-        device_id = device_row["id"]
 
-        ts = str(int(time.time()))
-        rnd = ''.join(random.choices(string.ascii_uppercase, k=4))
-        request_id = f"{ts}{rnd}"
+        # token_hex 直接产出字符串，省掉时间戳拼接和随机字母循环
+        # token_hex yields the id directly, no timestamp concat or letter loop
+        request_id = secrets.token_hex(16)
 
+        # 同管理员下发：参数即将变更，失效该设备的参数缓存
+        # As in the admin dispatch: the parameter is about to change, so
+        # invalidate this device's cached para
+        _device_para_cache.pop(req.device_sn, None)
         await conn.execute(
-            text("""
-                INSERT INTO device_rpc_change_log (
-                  device_id, operator, request_id, para_name, para_value, status, message
-                ) VALUES (
-                  :device_id, :operator, :request_id, :para_name, :para_value, 'pending', :message
-                )
-            """),
+            _INSERT_RPC_LOG_SQL,
             {
                 "device_id": device_id,
                 "operator": "user",
@@ -108,14 +123,13 @@ async def user_rpc_change(
         "para_value": req.para_value,
         "operator": "user",
         "message": req.message or f"user change {req.para_name} = {req.para_value}",
-        "timestamp": datetime.utcnow().isoformat() + "Z"
+        "timestamp": datetime.now(timezone.utc)
     }
-    publish.single(
-        topic,
-        json.dumps(payload),
-        hostname=os.getenv("MQTT_HOST"),
-        port=int(os.getenv("MQTT_PORT", "1883"))
-    )
+    # 入队即返回，发布由后台任务在长连接上完成
+    # Enqueue and return; the background task publishes on the shared connection
+    # OPT_UTC_Z 让 orjson 直接输出带 Z 的 RFC3339 时间戳
+    # OPT_UTC_Z makes orjson emit the RFC3339 timestamp with a Z suffix
+    await mqtt_client.enqueue(topic, orjson.dumps(payload, option=orjson.OPT_UTC_Z))
     return {"status": "ok", "request_id": request_id, "message": req.message}
 
 # 管理员/客服 RPC 下发
@@ -137,31 +151,19 @@ Admin/Service can send RPC requests to any device without parameter restrictions
 )
 async def rpc_change(
     req: RPCChangeRequest,
-    user=Depends(get_current_user)
+    user=Depends(require_admin_or_service)
 ):
-    if user["role"] not in ("admin", "service"):
-        raise HTTPException(status_code=403, detail="无权限")
+    # SN -> id 走进程内缓存，省掉热路径上的 devices 查询
+    # The cached resolver skips the devices SELECT on the hot path
+    device_id = await resolve_device_id(req.device_sn)
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="设备不存在")
     async with engine.begin() as conn:
-        device_row = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn"),
-            {"sn": req.device_sn}
-        )).mappings().first()
-        if not device_row:
-            raise HTTPException(status_code=404, detail="设备不存在")
-        device_id = device_row["id"]
-        
-        timestamp = str(int(time.time()))
-        random_letters = ''.join(random.choices(string.ascii_uppercase, k=4))
-        request_id = f"{timestamp}{random_letters}"
-        
+        request_id = secrets.token_hex(16)
+
+        _device_para_cache.pop(req.device_sn, None)
         await conn.execute(
-            text("""
-                INSERT INTO device_rpc_change_log (
-                  device_id, operator, request_id, para_name, para_value, status, message
-                ) VALUES (
-                  :device_id, :operator, :request_id, :para_name, :para_value, 'pending', :message
-                )
-            """),
+            _INSERT_RPC_LOG_SQL,
             {
                 "device_id": device_id,
                 "operator": user["username"],
@@ -179,20 +181,31 @@ async def rpc_change(
         "para_value": req.para_value,
         "operator": user["username"],
         "message": req.message or f"change {req.para_name} = {req.para_value}",
-        "timestamp": datetime.utcnow().isoformat() + "Z"
+        "timestamp": datetime.now(timezone.utc)
     }
-    publish.single(
-        mqtt_topic, 
-        json.dumps(mqtt_payload), 
-        hostname=os.getenv("MQTT_HOST"), 
-        port=int(os.getenv("MQTT_PORT", "1883"))
-    )
+    await mqtt_client.enqueue(mqtt_topic, orjson.dumps(mqtt_payload, option=orjson.OPT_UTC_Z))
     return {"status": "ok", "request_id": request_id, "message": req.message}
 
+# 同报警列表：按 WHERE 子句缓存 text() 对象 | Cache text() per WHERE clause
+@lru_cache(maxsize=32)
+def _rpc_history_sql(cond: str):
+    # device_sn 已冗余在日志表上（见 init/schema.sql），无需再 JOIN devices
+    # device_sn is denormalized onto the log table; no JOIN needed
+    return text(f"""
+        SELECT r.id, r.device_id, r.device_sn, r.operator, r.request_id,
+               r.para_name, r.para_value, r.status, r.message, r.created_at,
+               r.confirmed_at, COUNT(*) OVER() AS __total
+        FROM device_rpc_change_log r
+        {cond}
+        ORDER BY r.created_at DESC
+        LIMIT :limit OFFSET :offset
+    """)
+
 # RPC 变更历史
 @router.get(
     "/rpc_history",
-    response_model=RPCLogListResponse,
+    response_model=None,
+    responses={200: {"model": RPCLogListResponse}},
     summary="查询RPC变更历史 | Query RPC Change History",
     description="""
 **权限要求 | Required Role**: admin, service, support
@@ -214,14 +227,12 @@ async def get_rpc_history(
     operator: Optional[str] = Query(None, description="操作人用户名"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
-    user=Depends(get_current_user)
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
     where = []
     params = {}
     if device_sn:
-        where.append("d.device_sn = :device_sn")
+        where.append("r.device_sn = :device_sn")
         params["device_sn"] = device_sn
     if status:
         where.append("r.status = :status")
@@ -232,23 +243,13 @@ async def get_rpc_history(
     cond = "WHERE " + " AND ".join(where) if where else ""
     offset = (page - 1) * page_size
     async with engine.connect() as conn:
-        count_sql = text(f"""
-            SELECT COUNT(*) 
-            FROM device_rpc_change_log r
-            JOIN devices d ON r.device_id = d.id
-            {cond}
-        """)
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        query_sql = text(f"""
-            SELECT r.*, d.device_sn 
-            FROM device_rpc_change_log r
-            JOIN devices d ON r.device_id = d.id
-            {cond}
-            ORDER BY r.created_at DESC
-            LIMIT :limit OFFSET :offset
-        """)
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
-    items = [dict(row) for row in rows]
+        rows = (await conn.execute(_rpc_history_sql(cond), {**params, "limit": page_size, "offset": offset})).mappings().all()
+    total = rows[0]["__total"] if rows else 0
+    items = []
+    for row in rows:
+        d = dict(row)
+        d.pop("__total")
+        items.append(d)
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
 # 设备参数查询
@@ -270,22 +271,21 @@ Query current parameter configuration of specified device.
 )
 async def get_device_para(
     device_sn: str = Query(..., description="设备序列号"),
-    user=Depends(get_current_user)
+    user=Depends(require_staff)
 ):
-    if user["role"] not in ("admin", "service", "support"):
-        raise HTTPException(status_code=403, detail="无权限")
+    cached = _device_para_cache.get(device_sn)
+    if cached is not None:
+        return cached
+    device_id = await resolve_device_id(device_sn)
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="设备不存在")
     async with engine.connect() as conn:
-        device_row = (await conn.execute(
-            text("SELECT id FROM devices WHERE device_sn=:sn"),
-            {"sn": device_sn}
-        )).mappings().first()
-        if not device_row:
-            raise HTTPException(status_code=404, detail="设备不存在")
-        device_id = device_row["id"]
         row = (await conn.execute(
-            text("SELECT device_id, para, updated_at FROM device_para WHERE device_id=:id"),
+            _DEVICE_PARA_SQL,
             {"id": device_id}
         )).mappings().first()
     if not row:
         raise HTTPException(status_code=404, detail="设备参数不存在")
-    return row
\ No newline at end of file
+    result = dict(row)
+    _device_para_cache[device_sn] = result
+    return result
\ No newline at end of file
@@ -1,16 +1,147 @@
 from datetime import datetime, timezone, timedelta, date
 from datetime import time as dtime
 from typing import Optional, List, Any
+import asyncio
+import decimal
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import bcrypt  # 只保留修改密码需要的 bcrypt
 from sqlalchemy import text
-from deps import get_current_user
-from main import engine, async_session, online_flag, COLUMNS
+from deps import get_current_user, pop_user_info
+from main import engine, async_session, get_conn, online_flag, COLUMNS
 from config import DEVICE_FRESH_SECS
 
 router = APIRouter(prefix="/api/v1", tags=["用户 | User"])
 
+# 不变的 SQL 在导入时构建一次，请求内只做参数绑定（同 main.py 的做法）
+# Invariant SQL is built once at import time, as in main.py
+_REALTIME_PAGE_SQL = text(f"""
+    SELECT {COLUMNS},
+           (now() - r.updated_at) <= make_interval(secs => :fresh) AS online,
+           COUNT(*) OVER() AS __total
+    FROM ess_realtime_data r
+    JOIN devices d ON r.device_id = d.id
+    WHERE d.user_id = :user_id
+    ORDER BY r.updated_at DESC, r.device_id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+_REALTIME_KEYSET_SQL = text(f"""
+    SELECT {COLUMNS},
+           (now() - r.updated_at) <= make_interval(secs => :fresh) AS online,
+           COUNT(*) OVER() AS __total
+    FROM ess_realtime_data r
+    JOIN devices d ON r.device_id = d.id
+    WHERE d.user_id = :user_id
+      AND (r.updated_at, r.device_id) < (:after_ts, :after_id)
+    ORDER BY r.updated_at DESC, r.device_id DESC
+    LIMIT :limit
+""")
+
+def _resolve_period(period, query_date):
+    """把 period/date 参数解析为 (start, end, group_label)"""
+    now = datetime.now(timezone.utc)
+    if query_date:
+        start = datetime.combine(query_date, dtime.min).replace(tzinfo=timezone.utc)
+        end = datetime.combine(query_date, dtime.max).replace(tzinfo=timezone.utc)
+        return start, end, "hour"
+    if period == "today":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+        return start, end, "hour"
+    if period == "week":
+        start_of_week = now - timedelta(days=now.weekday())
+        start = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=6, hours=23, minutes=59, seconds=59, microseconds=999999)
+        return start, end, "day"
+    if period == "month":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        next_month = (now.replace(day=28) + timedelta(days=4)).replace(day=1)
+        end = next_month - timedelta(seconds=1)
+        return start, end, "day"
+    if period == "quarter":
+        quarter = (now.month - 1) // 3 + 1
+        start_month = (quarter - 1) * 3 + 1
+        start = now.replace(month=start_month, day=1, hour=0, minute=0, second=0, microsecond=0)
+        end_month = quarter * 3
+        next_quarter = start.replace(month=end_month + 1, day=1) if end_month < 12 else start.replace(year=start.year + 1, month=1, day=1)
+        end = next_quarter - timedelta(seconds=1)
+        return start, end, "month"
+    if period == "year":
+        start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = now.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
+        return start, end, "month"
+    raise HTTPException(status_code=400, detail="无效的 period 值")
+
+# 聚合粒度只有三种，页查询和导出 SQL 预先生成全部变体（同 main.py 的管理员版本），
+# 请求期只剩参数绑定，语句文本稳定也让编译缓存持续命中
+# Only three granularities exist, so page and export SQL are prebuilt per
+# label like the admin variant in main.py; requests just bind parameters
+# and the stable statement text keeps the compiled cache hot
+_HISTORY_GROUPS = (
+    ("hour", "date_trunc('hour', ts)"),
+    ("day", "date_trunc('day', ts)"),
+    ("month", "date_trunc('month', ts)"),
+)
+
+def _history_page_sql(group_expr, group_label):
+    # 非当前粒度的列直接 SELECT NULL，行可以原样返回，省掉逐行补空的循环
+    # Inactive granularity columns come back as NULL from SQL, so rows are
+    # returned as-is with no per-row fill-in loop
+    other = [l for l, _ in _HISTORY_GROUPS if l != group_label]
+    return text(f"""
+        SELECT
+            device_id,
+            d.device_sn,
+            {group_expr} AS {group_label},
+            NULL AS {other[0]},
+            NULL AS {other[1]},
+            SUM(charge_wh_total) AS charge_wh_total,
+            SUM(discharge_wh_total) AS discharge_wh_total,
+            SUM(pv_wh_total) AS pv_wh_total,
+            SUM(grid_wh_total) AS grid_wh_total,
+            SUM(load_wh_total) AS load_wh_total,
+            COUNT(*) OVER() AS __total
+        FROM history_energy
+        JOIN devices d ON d.id = history_energy.device_id
+        WHERE d.user_id = :uid AND ts >= :start AND ts <= :end
+        GROUP BY device_id, d.device_sn, {group_label}
+        ORDER BY {group_label} DESC
+        LIMIT :limit OFFSET :offset
+    """)
+
+def _history_export_sql(group_expr, group_label):
+    return text(f"""
+        SELECT
+            device_id,
+            d.device_sn,
+            {group_expr} AS {group_label},
+            SUM(charge_wh_total) AS charge_wh_total,
+            SUM(discharge_wh_total) AS discharge_wh_total,
+            SUM(pv_wh_total) AS pv_wh_total,
+            SUM(grid_wh_total) AS grid_wh_total,
+            SUM(load_wh_total) AS load_wh_total
+        FROM history_energy
+        JOIN devices d ON d.id = history_energy.device_id
+        WHERE d.user_id = :uid AND ts >= :start AND ts <= :end
+        GROUP BY device_id, d.device_sn, {group_label}
+        ORDER BY {group_label} DESC
+    """)
+
+_HISTORY_PAGE_SQL = {label: _history_page_sql(expr, label) for label, expr in _HISTORY_GROUPS}
+_HISTORY_EXPORT_SQL = {label: _history_export_sql(expr, label) for label, expr in _HISTORY_GROUPS}
+
+_MY_DEVICES_COUNT_SQL = text("SELECT COUNT(*) FROM devices WHERE user_id=:uid")
+_MY_DEVICES_PAGE_SQL = text("""
+    SELECT id, device_sn
+    FROM devices
+    WHERE user_id=:uid
+    ORDER BY id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
 class RealtimeData(BaseModel):
     device_id: int
     device_sn: str
@@ -58,38 +189,51 @@ class ChangePasswordRequest(BaseModel):
     old_password: str = Field(..., min_length=6, description="旧密码 | Old password")
     new_password: str = Field(..., min_length=6, description="新密码 | New password")
 
-@router.get("/realtime", response_model=ListResponse, summary="获取用户实时数据")
+# response_model=None 跳过 pydantic 逐行校验（数据本来就来自定型的数据库列），
+# 模型仅保留在 responses 里供 OpenAPI 文档使用
+@router.get("/realtime", response_model=None, responses={200: {"model": ListResponse}}, summary="获取用户实时数据")
 async def list_realtime(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
     fresh_secs: Optional[int] = Query(None),
-    user=Depends(get_current_user)
+    after_ts: Optional[datetime] = Query(None, description="游标分页：与 after_id 配合，只返回更早的行 | Keyset cursor, used with after_id"),
+    after_id: Optional[int] = Query(None, description="游标分页：上一页最后一行的 device_id | Keyset cursor: last device_id of previous page"),
+    user=Depends(get_current_user),
+    conn=Depends(get_conn)
 ):
     if user["role"] != "user":
         raise HTTPException(status_code=403, detail="权限错误")
     fresh = fresh_secs or DEVICE_FRESH_SECS
-    join_sql = "JOIN devices d ON r.device_id = d.id"
-    cond = "WHERE d.user_id = :user_id"
-    count_sql = text(f"SELECT COUNT(*) FROM ess_realtime_data r {join_sql} {cond}")
-    query_sql = text(f"""
-        SELECT {COLUMNS}
-        FROM ess_realtime_data r
-        {join_sql}
-        {cond}
-        ORDER BY r.updated_at DESC
-        LIMIT :limit OFFSET :offset
-    """)
-    offset = (page - 1) * page_size
-    params = {"user_id": user["user_id"], "limit": page_size, "offset": offset}
-    async with engine.connect() as conn:
-        total = (await conn.execute(count_sql, {"user_id": user["user_id"]})).scalar_one()
-        rows = (await conn.execute(query_sql, params)).mappings().all()
+    params = {"user_id": user["user_id"], "limit": page_size, "fresh": fresh}
+    # 传入游标时走键集分页：游标直接下推到索引，深页不再扫描丢弃 OFFSET 行。
+    # 批量灌数时同一批设备的 updated_at 完全相同，必须带 device_id 兜底排序，
+    # 否则与上页末行同时间戳的行会被整页跳过
+    # With a cursor, keyset pagination seeks the index directly instead of
+    # scanning and discarding OFFSET rows. Batch ingestion stamps a whole
+    # flush with the same updated_at, so device_id is a required tiebreaker —
+    # without it, rows sharing the previous page's last timestamp are skipped
+    if after_ts is not None and after_id is not None:
+        params["after_ts"] = after_ts
+        params["after_id"] = after_id
+        query_sql = _REALTIME_KEYSET_SQL
+    else:
+        params["offset"] = (page - 1) * page_size
+        query_sql = _REALTIME_PAGE_SQL
+    rows = (await conn.execute(query_sql, params)).mappings().all()
+    total = rows[0]["__total"] if rows else 0
+    # online 已在 SQL 里用 timestamptz 运算得出，Python 侧不再逐行计算
+    # online is computed server-side in the query; no per-row Python work
     items = []
     for r in rows:
         d = dict(r)
-        d["online"] = online_flag(d["updated_at"], DEVICE_FRESH_SECS)
+        d.pop("__total")
         items.append(d)
-    return {"items": items, "page": page, "page_size": page_size, "total": total}
+    # 满页时给出下一页游标，客户端回传 after_ts/after_id 继续翻页
+    next_cursor = (
+        {"after_ts": items[-1]["updated_at"], "after_id": items[-1]["device_id"]}
+        if len(items) == page_size else None
+    )
+    return {"items": items, "page": page, "page_size": page_size, "total": total, "next_cursor": next_cursor}
 
 @router.post("/device/bind", summary="绑定设备 | Bind Device", tags=["用户 | User"])
 async def bind_device(data: BindDeviceRequest, user=Depends(get_current_user)):
@@ -97,21 +241,33 @@ async def bind_device(data: BindDeviceRequest, user=Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="权限错误")
     async with async_session() as session:
         async with session.begin():
-            # 行级锁避免并发抢占
+            # 锁定、判断、更新合并成一条语句（行级锁仍在，避免并发抢占），
+            # RETURNING 带回旧 user_id 用于区分"绑定成功/已绑定到当前用户"
+            # Lock, check and update in one statement (row lock kept);
+            # RETURNING the old user_id distinguishes fresh bind vs rebind
             row = (await session.execute(
-                text("SELECT id, user_id FROM devices WHERE device_sn=:sn FOR UPDATE"),
+                text("""
+                    UPDATE devices d
+                    SET user_id = :uid
+                    FROM (SELECT id, user_id AS old_uid FROM devices WHERE device_sn = :sn FOR UPDATE) o
+                    WHERE d.id = o.id AND (o.old_uid IS NULL OR o.old_uid = :uid)
+                    RETURNING o.old_uid
+                """),
+                {"uid": user["user_id"], "sn": data.device_sn}
+            )).first()
+            if row is not None:
+                if row.old_uid is None:
+                    await pop_user_info(user["user_id"])
+                    return {"msg": "绑定成功", "device_sn": data.device_sn}
+                return {"msg": "设备已绑定到当前用户", "device_sn": data.device_sn}
+            # 没有行被更新才补一次探查，区分 404 与 409
+            # Probe only when nothing updated, to pick 404 vs 409
+            exists = (await session.execute(
+                text("SELECT 1 FROM devices WHERE device_sn=:sn"),
                 {"sn": data.device_sn}
-            )).mappings().first()
-            if not row:
+            )).first()
+            if not exists:
                 raise HTTPException(status_code=404, detail="设备不存在")
-            if row["user_id"] is None:
-                await session.execute(
-                    text("UPDATE devices SET user_id=:uid WHERE id=:id"),
-                    {"uid": user["user_id"], "id": row["id"]}
-                )
-                return {"msg": "绑定成功", "device_sn": data.device_sn}
-            if row["user_id"] == user["user_id"]:
-                return {"msg": "设备已绑定到当前用户", "device_sn": data.device_sn}
             raise HTTPException(status_code=409, detail="设备已绑定到其他用户")
 
 @router.post("/device/unbind", summary="解绑设备 | Unbind Device", tags=["用户 | User"])
@@ -137,6 +293,7 @@ async def unbind_device(data: UnbindDeviceRequest, user=Depends(get_current_user
                 if not owned:
                     raise HTTPException(status_code=404, detail="设备不存在")
                 raise HTTPException(status_code=403, detail="设备不属于当前用户")
+            await pop_user_info(user["user_id"])
             return {"msg": "解绑成功", "device_sn": data.device_sn}
 
 # 新增：修改密码
@@ -145,20 +302,28 @@ async def change_password(data: ChangePasswordRequest, user=Depends(get_current_
     if user["role"] != "user":
         raise HTTPException(status_code=403, detail="权限错误")
     async with async_session() as session:
-        row = (await session.execute(
+        password_hash = (await session.execute(
             text("SELECT password_hash FROM users WHERE id=:uid"),
             {"uid": user["user_id"]}
-        )).first()
-        if not row:
+        )).scalar_one_or_none()
+        if password_hash is None:
             raise HTTPException(status_code=404, detail="用户不存在")
-        if not bcrypt.checkpw(data.old_password.encode(), row.password_hash.encode()):
+        # bcrypt 校验/加盐是上百毫秒的纯 CPU 计算，放线程池避免卡事件循环（同 auth）
+        # bcrypt is ~100ms of pure CPU; run in a thread like auth does
+        ok = await asyncio.to_thread(
+            bcrypt.checkpw, data.old_password.encode(), password_hash.encode()
+        )
+        if not ok:
             raise HTTPException(status_code=400, detail="旧密码不正确")
-        new_hash = bcrypt.hashpw(data.new_password.encode(), bcrypt.gensalt()).decode()
+        new_hash = (await asyncio.to_thread(
+            bcrypt.hashpw, data.new_password.encode(), bcrypt.gensalt()
+        )).decode()
         await session.execute(
             text("UPDATE users SET password_hash=:ph WHERE id=:uid"),
             {"ph": new_hash, "uid": user["user_id"]}
         )
         await session.commit()
+    await pop_user_info(user["user_id"])
     return {"msg": "修改成功"}
 
 # 新增：我的设备列表（分页）
@@ -173,17 +338,11 @@ async def list_my_devices(
     offset = (page - 1) * page_size
     async with async_session() as session:
         total = (await session.execute(
-            text("SELECT COUNT(*) FROM devices WHERE user_id=:uid"),
+            _MY_DEVICES_COUNT_SQL,
             {"uid": user["user_id"]}
         )).scalar_one()
         rows = (await session.execute(
-            text("""
-                SELECT id, device_sn
-                FROM devices
-                WHERE user_id=:uid
-                ORDER BY id DESC
-                LIMIT :limit OFFSET :offset
-            """),
+            _MY_DEVICES_PAGE_SQL,
             {"uid": user["user_id"], "limit": page_size, "offset": offset}
         )).mappings().all()
     return {"items": rows, "page": page, "page_size": page_size, "total": total}
@@ -209,7 +368,8 @@ class HistoryAggListResponse(BaseModel):
 
 @router.get(
     "/history",
-    response_model=HistoryAggListResponse,
+    response_model=None,
+    responses={200: {"model": HistoryAggListResponse}},
     tags=["用户 | User"],
     summary="历史能耗聚合数据 | Aggregated History Energy Data",
 )
@@ -218,110 +378,70 @@ async def list_history(
     date: Optional[date] = Query(None, description="YYYY-MM-DD, 小时级聚合"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
-    user=Depends(get_current_user)
+    user=Depends(get_current_user),
+    conn=Depends(get_conn)
 ):
     if user["role"] in ("admin", "service", "support"):
         raise HTTPException(status_code=403, detail="管理员/客服/支持请使用专用接口")
 
-    now = datetime.now(timezone.utc)
-    if date:
-        start = datetime.combine(date, dtime.min).replace(tzinfo=timezone.utc)
-        end = datetime.combine(date, dtime.max).replace(tzinfo=timezone.utc)
-        group_expr, group_label = "date_trunc('hour', ts)", "hour"
-    else:
-        if period == "today":
-            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            group_expr, group_label = "date_trunc('hour', ts)", "hour"
-        elif period == "week":
-            start_of_week = now - timedelta(days=now.weekday())
-            start = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-            end = start + timedelta(days=6, hours=23, minutes=59, seconds=59, microseconds=999999)
-            group_expr, group_label = "date_trunc('day', ts)", "day"
-        elif period == "month":
-            start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            next_month = (now.replace(day=28) + timedelta(days=4)).replace(day=1)
-            end = next_month - timedelta(seconds=1)
-            group_expr, group_label = "date_trunc('day', ts)", "day"
-        elif period == "quarter":
-            quarter = (now.month - 1) // 3 + 1
-            start_month = (quarter - 1) * 3 + 1
-            start = now.replace(month=start_month, day=1, hour=0, minute=0, second=0, microsecond=0)
-            end_month = quarter * 3
-            next_quarter = start.replace(month=end_month + 1, day=1) if end_month < 12 else start.replace(year=start.year + 1, month=1, day=1)
-            end = next_quarter - timedelta(seconds=1)
-            group_expr, group_label = "date_trunc('month', ts)", "month"
-        elif period == "year":
-            start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            end = now.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
-            group_expr, group_label = "date_trunc('month', ts)", "month"
-        else:
-            raise HTTPException(status_code=400, detail="无效的 period 值")
+    start, end, group_label = _resolve_period(period, date)
 
-    async with engine.connect() as conn:
-        devices = (await conn.execute(
-            text("SELECT id, device_sn FROM devices WHERE user_id=:uid"),
-            {"uid": user["user_id"]}
-        )).mappings().all()
-        if not devices:
-            return {"items": [], "page": page, "page_size": page_size, "total": 0}
-
-        device_ids = [d["id"] for d in devices]
-        device_sn_map = {d["id"]: d["device_sn"] for d in devices}
-        placeholders = ",".join([f":id{i}" for i in range(len(device_ids))])
-        params = {f"id{i}": did for i, did in enumerate(device_ids)}
-        params.update({"start": start, "end": end})
-
-        where = [f"device_id IN ({placeholders})", "ts >= :start", "ts <= :end"]
-        cond = "WHERE " + " AND ".join(where)
-        offset = (page - 1) * page_size
-
-        count_sql = text(f"""
-            SELECT COUNT(*) FROM (
-                SELECT {group_expr} AS {group_label}, device_id
-                FROM history_energy
-                {cond}
-                GROUP BY device_id, {group_label}
-            ) t
-        """)
-        query_sql = text(f"""
-            SELECT
-                device_id,
-                {group_expr} AS {group_label},
-                SUM(charge_wh_total) AS charge_wh_total,
-                SUM(discharge_wh_total) AS discharge_wh_total,
-                SUM(pv_wh_total) AS pv_wh_total,
-                SUM(grid_wh_total) AS grid_wh_total,
-                SUM(load_wh_total) AS load_wh_total
-            FROM history_energy
-            {cond}
-            GROUP BY device_id, {group_label}
-            ORDER BY {group_label} DESC
-            LIMIT :limit OFFSET :offset
-        """)
-
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
+    # 直接 JOIN devices，省掉预查询和 Python 端的 device_sn 映射
+    params = {"uid": user["user_id"], "start": start, "end": end}
+    offset = (page - 1) * page_size
+    query_sql = _HISTORY_PAGE_SQL[group_label]
 
+    total = 0
+    # 流式读取，边取边组装，避免先整页物化再遍历
+    result = await conn.stream(query_sql, {**params, "limit": page_size, "offset": offset})
     items = []
-    for r in rows:
+    async for r in result.mappings():
         d = dict(r)
-        d["device_sn"] = device_sn_map.get(d["device_id"], "")
-        if group_label == "hour":
-            d["hour"] = d.pop("hour")
-            d["day"] = None
-            d["month"] = None
-        elif group_label == "day":
-            d["day"] = d.pop("day")
-            d["hour"] = None
-            d["month"] = None
-        elif group_label == "month":
-            d["month"] = d.pop("month")
-            d["hour"] = None
-            d["day"] = None
+        total = d.pop("__total")
         items.append(d)
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
+def _ndjson_default(obj):
+    # SUM() 聚合列是 numeric，orjson 只在遇到 Decimal 时转换
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    return str(obj)
+
+@router.get(
+    "/history/export",
+    tags=["用户 | User"],
+    summary="导出历史能耗聚合数据 | Export Aggregated History Energy Data",
+    description="""
+**权限要求 | Required Role**: user
+
+按 NDJSON（每行一个 JSON 对象）流式导出聚合结果，不分页。
+边查边发，内存占用与结果集大小无关，客户端可边下载边处理。
+
+Streams the aggregated result as NDJSON (one JSON object per line),
+unpaginated. Rows are encoded as they arrive from the server-side
+cursor, so memory stays flat regardless of result size.
+""",
+)
+async def export_history(
+    period: str = Query("today", description="today/week/month/quarter/year"),
+    date: Optional[date] = Query(None, description="YYYY-MM-DD, 小时级聚合"),
+    user=Depends(get_current_user)
+):
+    if user["role"] in ("admin", "service", "support"):
+        raise HTTPException(status_code=403, detail="管理员/客服/支持请使用专用接口")
+
+    start, end, group_label = _resolve_period(period, date)
+    params = {"uid": user["user_id"], "start": start, "end": end}
+    query_sql = _HISTORY_EXPORT_SQL[group_label]
+
+    async def _rows():
+        async with engine.connect() as conn:
+            result = await conn.stream(query_sql, params)
+            async for r in result.mappings():
+                yield orjson.dumps(dict(r), default=_ndjson_default) + b"\n"
+
+    return StreamingResponse(_rows(), media_type="application/x-ndjson")
+
 # 报警模型
 class AlarmItem(BaseModel):
     alarm_id: int = Field(..., alias="alarm_id")
@@ -342,6 +462,13 @@ class AlarmItem(BaseModel):
     class Config:
         allow_population_by_field_name = True
 
+# 显式列清单并在 SQL 里别名 alarm_id（同管理员列表），免去逐行改名
+# Explicit columns with alarm_id aliased in SQL, as in the admin list
+_ALARM_LIST_COLS = """a.id AS alarm_id, a.device_id, a.alarm_type, a.code, a.level,
+            a.extra, a.status, a.first_triggered_at, a.last_triggered_at,
+            a.repeat_count, a.remark, a.confirmed_at, a.confirmed_by,
+            a.cleared_at, a.cleared_by"""
+
 class AlarmListResponse(BaseModel):
     items: List[AlarmItem]
     page: int
@@ -351,7 +478,8 @@ class AlarmListResponse(BaseModel):
 # 我的报警（当前）
 @router.get(
     "/alarms/user",
-    response_model=AlarmListResponse,
+    response_model=None,
+    responses={200: {"model": AlarmListResponse}},
     tags=["用户 | User"],
     summary="查询本人设备报警 | Query My Device Alarms",
 )
@@ -361,52 +489,62 @@ async def list_my_alarms(
     status: Optional[str] = Query(None),
     level: Optional[str] = Query(None),
     code: Optional[int] = Query(None),
-    user=Depends(get_current_user)
+    before_ts: Optional[datetime] = Query(None, description="游标分页：与 before_id 配合，只返回更早的行 | Keyset cursor, used with before_id"),
+    before_id: Optional[int] = Query(None, description="游标分页：上一页最后一行的 alarm_id | Keyset cursor: last alarm_id of previous page"),
+    user=Depends(get_current_user),
+    conn=Depends(get_conn)
 ):
     if user["role"] in ("admin", "service", "support"):
         raise HTTPException(status_code=403, detail="管理员/客服/支持请用专用接口")
-    async with engine.connect() as conn:
-        devices = (await conn.execute(
-            text("SELECT id FROM devices WHERE user_id=:uid"),
-            {"uid": user["user_id"]}
-        )).scalars().all()
-    if not devices:
-        return {"items": [], "page": page, "page_size": page_size, "total": 0}
-
-    placeholders = ",".join([f":id{i}" for i in range(len(devices))])
-    params = {f"id{i}": did for i, did in enumerate(devices)}
-    where = [f"device_id IN ({placeholders})"]
+    # 直接 JOIN devices 过滤归属，省掉设备预查询那次往返
+    # Join devices for ownership filtering instead of prefetching the id list
+    params = {"uid": user["user_id"]}
+    where = ["d.user_id = :uid"]
     if status:
-        where.append("status = :status"); params["status"] = status
+        where.append("a.status = :status"); params["status"] = status
     if level:
-        where.append("level = :level"); params["level"] = level
+        where.append("a.level = :level"); params["level"] = level
     if code:
-        where.append("code = :code"); params["code"] = code
+        where.append("a.code = :code"); params["code"] = code
+    # 传入游标时走键集分页：行比较直接下推到索引，深页不再扫描丢弃 OFFSET 行
+    # With a cursor, keyset pagination seeks the index via a row comparison
+    # instead of scanning and discarding OFFSET rows on deep pages
+    if before_ts is not None and before_id is not None:
+        where.append("(a.first_triggered_at, a.id) < (:before_ts, :before_id)")
+        params["before_ts"] = before_ts
+        params["before_id"] = before_id
+        params["offset"] = 0
+    else:
+        params["offset"] = (page - 1) * page_size
     cond = "WHERE " + " AND ".join(where)
-    offset = (page - 1) * page_size
 
-    async with engine.connect() as conn:
-        count_sql = text(f"SELECT COUNT(*) FROM alarms {cond}")
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        query_sql = text(f"""
-            SELECT *
-            FROM alarms
-            {cond}
-            ORDER BY first_triggered_at DESC
-            LIMIT :limit OFFSET :offset
-        """)
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
-        items = []
-        for row in rows:
-            d = dict(row)
-            d["alarm_id"] = d.pop("id")
-            items.append(d)
-    return {"items": items, "page": page, "page_size": page_size, "total": total}
+    query_sql = text(f"""
+        SELECT {_ALARM_LIST_COLS}, COUNT(*) OVER() AS __total
+        FROM alarms a
+        JOIN devices d ON d.id = a.device_id
+        {cond}
+        ORDER BY a.first_triggered_at DESC, a.id DESC
+        LIMIT :limit OFFSET :offset
+    """)
+    rows = (await conn.execute(query_sql, {**params, "limit": page_size})).mappings().all()
+    total = rows[0]["__total"] if rows else 0
+    items = []
+    for row in rows:
+        d = dict(row)
+        d.pop("__total")
+        items.append(d)
+    # 满页时返回下一页游标 | Full page: hand back the cursor for the next one
+    next_cursor = (
+        {"before_ts": items[-1]["first_triggered_at"], "before_id": items[-1]["alarm_id"]}
+        if len(items) == page_size else None
+    )
+    return {"items": items, "page": page, "page_size": page_size, "total": total, "next_cursor": next_cursor}
 
 # 我的历史报警
 @router.get(
     "/alarms/history",
-    response_model=AlarmListResponse,
+    response_model=None,
+    responses={200: {"model": AlarmListResponse}},
     tags=["用户 | User"],
     summary="查询本人设备历史报警 | Query My Device Alarm History",
 )
@@ -416,47 +554,56 @@ async def list_my_alarm_history(
     status: Optional[str] = Query(None),
     level: Optional[str] = Query(None),
     code: Optional[int] = Query(None),
-    user=Depends(get_current_user)
+    before_ts: Optional[datetime] = Query(None, description="游标分页：与 before_id 配合，只返回更早的行 | Keyset cursor, used with before_id"),
+    before_id: Optional[int] = Query(None, description="游标分页：上一页最后一行的 alarm_id | Keyset cursor: last alarm_id of previous page"),
+    user=Depends(get_current_user),
+    conn=Depends(get_conn)
 ):
     if user["role"] in ("admin", "service", "support"):
         raise HTTPException(status_code=403, detail="管理员/客服/支持请用专用接口")
-    async with engine.connect() as conn:
-        devices = (await conn.execute(
-            text("SELECT id FROM devices WHERE user_id=:uid"),
-            {"uid": user["user_id"]}
-        )).scalars().all()
-    if not devices:
-        return {"items": [], "page": page, "page_size": page_size, "total": 0}
-
-    placeholders = ",".join([f":id{i}" for i in range(len(devices))])
-    params = {f"id{i}": did for i, did in enumerate(devices)}
-    where = [f"device_id IN ({placeholders})"]
+    # 直接 JOIN devices 过滤归属，省掉设备预查询那次往返
+    # Join devices for ownership filtering instead of prefetching the id list
+    params = {"uid": user["user_id"]}
+    where = ["d.user_id = :uid"]
     if status:
-        where.append("status = :status"); params["status"] = status
+        where.append("a.status = :status"); params["status"] = status
     if level:
-        where.append("level = :level"); params["level"] = level
+        where.append("a.level = :level"); params["level"] = level
     if code:
-        where.append("code = :code"); params["code"] = code
+        where.append("a.code = :code"); params["code"] = code
+    # 传入游标时走键集分页：行比较直接下推到索引，深页不再扫描丢弃 OFFSET 行
+    # With a cursor, keyset pagination seeks the index via a row comparison
+    # instead of scanning and discarding OFFSET rows on deep pages
+    if before_ts is not None and before_id is not None:
+        where.append("(a.first_triggered_at, a.id) < (:before_ts, :before_id)")
+        params["before_ts"] = before_ts
+        params["before_id"] = before_id
+        params["offset"] = 0
+    else:
+        params["offset"] = (page - 1) * page_size
     cond = "WHERE " + " AND ".join(where)
-    offset = (page - 1) * page_size
 
-    async with engine.connect() as conn:
-        count_sql = text(f"SELECT COUNT(*) FROM alarm_history {cond}")
-        total = (await conn.execute(count_sql, params)).scalar_one()
-        query_sql = text(f"""
-            SELECT *
-            FROM alarm_history
-            {cond}
-            ORDER BY first_triggered_at DESC
-            LIMIT :limit OFFSET :offset
-        """)
-        rows = (await conn.execute(query_sql, {**params, "limit": page_size, "offset": offset})).mappings().all()
-        items = []
-        for row in rows:
-            d = dict(row)
-            d["alarm_id"] = d.pop("id")
-            items.append(d)
-    return {"items": items, "page": page, "page_size": page_size, "total": total}
+    query_sql = text(f"""
+        SELECT {_ALARM_LIST_COLS}, COUNT(*) OVER() AS __total
+        FROM alarm_history a
+        JOIN devices d ON d.id = a.device_id
+        {cond}
+        ORDER BY a.first_triggered_at DESC, a.id DESC
+        LIMIT :limit OFFSET :offset
+    """)
+    rows = (await conn.execute(query_sql, {**params, "limit": page_size})).mappings().all()
+    total = rows[0]["__total"] if rows else 0
+    items = []
+    for row in rows:
+        d = dict(row)
+        d.pop("__total")
+        items.append(d)
+    # 满页时返回下一页游标 | Full page: hand back the cursor for the next one
+    next_cursor = (
+        {"before_ts": items[-1]["first_triggered_at"], "before_id": items[-1]["alarm_id"]}
+        if len(items) == page_size else None
+    )
+    return {"items": items, "page": page, "page_size": page_size, "total": total, "next_cursor": next_cursor}
 
 async def get_realtime(user=Depends(get_current_user)):
     async with engine.connect() as conn:
@@ -28,6 +28,18 @@ CREATE INDEX IF NOT EXISTS idx_alarms_first_triggered_at ON alarms(first_trigger
 CREATE INDEX IF NOT EXISTS idx_alarms_device_type_level
   ON alarms(device_id, alarm_type, level);
 
+-- 列表接口按 first_triggered_at DESC, id DESC 排序（含键集游标），
+-- 复合索引让按设备过滤的分页直接走索引序
+-- List endpoints sort by first_triggered_at DESC, id DESC (incl. keyset
+-- cursors); this lets device-filtered pages read in index order
+CREATE INDEX IF NOT EXISTS idx_alarms_device_ftrig
+  ON alarms(device_id, first_triggered_at DESC, id DESC);
+
+-- 未处理报警统计的部分索引：只覆盖未处理状态，按 level 聚合走 index-only
+-- Partial index for the unhandled counters; level grouping goes index-only
+CREATE INDEX IF NOT EXISTS idx_alarms_unhandled_level
+  ON alarms(level) WHERE status IN ('active', 'confirmed');
+
 -- 历史报警表 alarm_history
 CREATE TABLE IF NOT EXISTS alarm_history (
   id BIGSERIAL PRIMARY KEY,
@@ -58,4 +70,48 @@ CREATE INDEX IF NOT EXISTS idx_alarm_history_archived_at ON alarm_history(archiv
 
 -- alarm_history 表联合索引
 CREATE INDEX IF NOT EXISTS idx_alarm_history_device_type_level
-  ON alarm_history(device_id, alarm_type, level);
\ No newline at end of file
+  ON alarm_history(device_id, alarm_type, level);
+
+-- 同 alarms：按设备过滤的分页列表走索引序
+-- As on alarms: device-filtered pagination reads in index order
+CREATE INDEX IF NOT EXISTS idx_alarm_history_device_ftrig
+  ON alarm_history(device_id, first_triggered_at DESC, id DESC);
+-- 冗余 device_sn 到报警表：列表接口只为取/筛 SN 而 JOIN devices，
+-- SN 在设备出厂后不变，冗余一列即可去掉这次 JOIN；
+-- 触发器在插入时自动回填，存量行由下方 UPDATE 补齐
+-- Denormalize device_sn onto the alarm tables: the list endpoints joined
+-- devices only to fetch/filter the SN, which never changes after
+-- provisioning. A BEFORE INSERT trigger fills new rows; the UPDATEs
+-- backfill existing ones.
+ALTER TABLE alarms ADD COLUMN IF NOT EXISTS device_sn TEXT;
+ALTER TABLE alarm_history ADD COLUMN IF NOT EXISTS device_sn TEXT;
+CREATE INDEX IF NOT EXISTS idx_alarms_device_sn ON alarms(device_sn);
+
+CREATE OR REPLACE FUNCTION fill_device_sn() RETURNS trigger AS $$
+BEGIN
+  IF NEW.device_sn IS NULL AND NEW.device_id IS NOT NULL THEN
+    SELECT device_sn INTO NEW.device_sn FROM devices WHERE id = NEW.device_id;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_alarms_fill_sn ON alarms;
+CREATE TRIGGER trg_alarms_fill_sn BEFORE INSERT ON alarms
+  FOR EACH ROW EXECUTE FUNCTION fill_device_sn();
+
+DROP TRIGGER IF EXISTS trg_alarm_history_fill_sn ON alarm_history;
+CREATE TRIGGER trg_alarm_history_fill_sn BEFORE INSERT ON alarm_history
+  FOR EACH ROW EXECUTE FUNCTION fill_device_sn();
+
+UPDATE alarms a SET device_sn = d.device_sn
+  FROM devices d WHERE a.device_id = d.id AND a.device_sn IS NULL;
+UPDATE alarm_history h SET device_sn = d.device_sn
+  FROM devices d WHERE h.device_id = d.id AND h.device_sn IS NULL;
+
+DROP TRIGGER IF EXISTS trg_rpc_change_log_fill_sn ON device_rpc_change_log;
+CREATE TRIGGER trg_rpc_change_log_fill_sn BEFORE INSERT ON device_rpc_change_log
+  FOR EACH ROW EXECUTE FUNCTION fill_device_sn();
+
+UPDATE device_rpc_change_log r SET device_sn = d.device_sn
+  FROM devices d WHERE r.device_id = d.id AND r.device_sn IS NULL;
@@ -88,6 +88,10 @@ CREATE TABLE IF NOT EXISTS ess_realtime_data (
 
 -- 实时数据表索引
 -- Realtime data table indexes
+-- 说明：device_id 已是主键（每设备一行快照），查询按 user_id 过滤走 ix_devices_user_id，
+-- 按时间排序走本索引，无需再建 (device_id, updated_at) 联合索引
+-- Note: device_id is the PK (one snapshot row per device); user filtering uses
+-- ix_devices_user_id and the sort uses this index, so no composite index is needed
 CREATE INDEX IF NOT EXISTS idx_ess_updated  ON ess_realtime_data (updated_at DESC);
 
 -- 历史能耗数据表（分区表）
@@ -237,6 +241,13 @@ CREATE INDEX IF NOT EXISTS idx_rpc_change_log_device_id ON device_rpc_change_log
 CREATE INDEX IF NOT EXISTS idx_rpc_change_log_request_id ON device_rpc_change_log(request_id);
 CREATE INDEX IF NOT EXISTS idx_rpc_change_log_status ON device_rpc_change_log(status);
 CREATE INDEX IF NOT EXISTS idx_rpc_change_log_created_at ON device_rpc_change_log(created_at DESC);
+-- RPC 历史按设备过滤时的排序索引 | Ordered scan for device-filtered RPC history
+CREATE INDEX IF NOT EXISTS idx_rpc_change_log_device_created ON device_rpc_change_log(device_id, created_at DESC);
+
+-- 冗余 device_sn（同 alarms，见 init/alarm.sql 的说明与 fill_device_sn 触发器）
+-- Denormalized device_sn; see init/alarm.sql for rationale and the trigger
+ALTER TABLE device_rpc_change_log ADD COLUMN IF NOT EXISTS device_sn TEXT;
+CREATE INDEX IF NOT EXISTS idx_rpc_change_log_device_sn ON device_rpc_change_log(device_sn);
 
 
 